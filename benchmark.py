@@ -0,0 +1,436 @@
+"""End-to-end latency and upstream call-count benchmark for the digest bot.
+
+Starts local stub servers for Jira search, Bitbucket pull requests/comments/activity,
+Ollama chat and the Slack Web API, generates a synthetic team, then runs each command
+from main.py in a fresh subprocess pointed at the stubs and reports wall time, peak
+Python memory and upstream requests per endpoint.
+
+    python benchmark.py                          # 5, 50 and 500 users, every command
+    python benchmark.py --users 5,50 --commands myday,teamday --bitbucket-latency-ms 80
+    python benchmark.py --json bench_results.json
+"""
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+COMMANDS = ["myday", "teamday", "team-metrics", "priority", "priority-me", "scheduled"]
+PRIORITIES = ["Highest", "High", "Medium", "Low"]
+STATUSES = ["To Do", "In Progress", "In Review", "Blocked"]
+
+
+def iso(ts):
+    return ts.strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+
+
+def build_dataset(users, repos, prs_per_repo, issues_per_user, comments_per_pr, seed):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    people = [
+        {"slack_id": f"U{i:05d}", "email": f"user{i}@bench.example", "username": f"user{i}"}
+        for i in range(users)
+    ]
+
+    issues = []
+    for person in people:
+        for n in range(issues_per_user):
+            issues.append({
+                "key": f"BENCH-{len(issues) + 1}",
+                "fields": {
+                    "summary": f"Synthetic issue {n} for {person['username']}",
+                    "status": {"name": rng.choice(STATUSES)},
+                    "priority": {"name": rng.choice(PRIORITIES)},
+                    "duedate": (now + timedelta(days=rng.randint(-3, 20))).strftime("%Y-%m-%d"),
+                    "assignee": {"emailAddress": person["email"]},
+                },
+            })
+
+    prs = {}
+    for r in range(repos):
+        repo = f"repo{r}"
+        for pr_id in range(1, prs_per_repo + 1):
+            author = rng.choice(people)
+            reviewers = rng.sample([p for p in people if p is not author], min(2, len(people) - 1))
+            created = now - timedelta(days=rng.uniform(0, 14))
+            events = [{"update": {"date": iso(created), "author": {"username": author["username"]},
+                                  "reviewers": [{"username": p["username"]} for p in reviewers]}}]
+            for reviewer in reviewers:
+                if rng.random() < 0.7:
+                    kind = rng.choice(["approval", "comment"])
+                    reviewed = created + timedelta(hours=rng.uniform(1, 96))
+                    key = "date" if kind == "approval" else "created_on"
+                    events.append({kind: {key: iso(reviewed), "user": {"username": reviewer["username"]}}})
+            events.sort(key=lambda e: next(iter(e.values())).get("date") or next(iter(e.values())).get("created_on"), reverse=True)
+            comments = [{"id": c, "deleted": False, "resolved": rng.random() < 0.6} for c in range(comments_per_pr)]
+            prs[(repo, pr_id)] = {
+                "pr": {
+                    "id": pr_id,
+                    "title": f"Synthetic change {pr_id} in {repo}",
+                    "state": "OPEN",
+                    "created_on": iso(created),
+                    "updated_on": iso(created + timedelta(hours=1)),
+                    "comment_count": comments_per_pr,
+                    "author": {"username": author["username"], "display_name": author["username"]},
+                    "reviewers": [{"username": p["username"], "display_name": p["username"]} for p in reviewers],
+                    "destination": {"repository": {"slug": repo}},
+                },
+                "activity": events,
+                "comments": comments,
+            }
+    return {"people": people, "issues": issues, "prs": prs, "repos": [f"repo{r}" for r in range(repos)]}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, name, handler, dataset, latency_ms, options):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.name = name
+        self.dataset = dataset
+        self.latency = latency_ms / 1000
+        self.options = options
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, endpoint):
+        with self.lock:
+            self.counts[endpoint] += 1
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == "/_stats":
+            with self.server.lock:
+                return self.send_json(dict(self.server.counts))
+        time.sleep(self.server.latency)
+        self.handle_get(parsed, {k: v[-1] for k, v in parse_qs(parsed.query).items()})
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        body = self.read_body()
+        time.sleep(self.server.latency)
+        self.handle_post(parsed, body)
+
+    def handle_get(self, parsed, params):
+        self.send_json({"error": "not found"}, 404)
+
+    def handle_post(self, parsed, body):
+        self.send_json({"error": "not found"}, 404)
+
+
+class JiraStub(StubHandler):
+    def handle_get(self, parsed, params):
+        if not parsed.path.endswith("/rest/api/3/search"):
+            return super().handle_get(parsed, params)
+        self.server.count("jira.search")
+        jql = params.get("jql", "")
+        emails = set(re.findall(r"'([^']+@[^']+)'", jql))
+        wanted_priorities = None
+        match = re.search(r"priority in \(([^)]*)\)", jql)
+        if match:
+            wanted_priorities = set(re.findall(r'"([^"]+)"', match.group(1)))
+        issues = [
+            i for i in self.server.dataset["issues"]
+            if i["fields"]["assignee"]["emailAddress"] in emails
+            and (wanted_priorities is None or i["fields"]["priority"]["name"] in wanted_priorities)
+        ]
+        start = int(params.get("startAt", 0))
+        size = min(int(params.get("maxResults", 50)), 100)
+        self.send_json({"startAt": start, "maxResults": size, "total": len(issues), "issues": issues[start:start + size]})
+
+
+class BitbucketStub(StubHandler):
+    def page(self, values, params, max_pagelen):
+        pagelen = min(int(params.get("pagelen", 10)), max_pagelen)
+        page = int(params.get("page", 1))
+        payload = {"size": len(values), "page": page, "pagelen": pagelen,
+                   "values": values[(page - 1) * pagelen:page * pagelen]}
+        if page * pagelen < len(values):
+            query = dict(params, page=page + 1)
+            payload["next"] = f"{self.server.url}{urlparse(self.path).path}?{urlencode(query)}"
+        return payload
+
+    def handle_get(self, parsed, params):
+        match = re.match(r".*/repositories/([^/]+)/([^/]+)/pullrequests(?:/(\d+)/(comments|activity))?/?$", parsed.path)
+        if not match:
+            return super().handle_get(parsed, params)
+        _, repo, pr_id, sub = match.groups()
+        prs = self.server.dataset["prs"]
+
+        if sub == "comments":
+            self.server.count("bitbucket.comments")
+            return self.send_json(self.page(prs[(repo, int(pr_id))]["comments"], params, 100))
+        if sub == "activity":
+            self.server.count("bitbucket.activity")
+            return self.send_json(self.page(prs[(repo, int(pr_id))]["activity"], params, 50))
+
+        self.server.count("bitbucket.pullrequests")
+        q = params.get("q", "")
+        author = re.search(r'author\.username="([^"]+)"', q)
+        reviewer = re.search(r'reviewers\.username="([^"]+)"', q)
+        values = []
+        for (pr_repo, number), entry in sorted(prs.items()):
+            pr = entry["pr"]
+            if pr_repo != repo:
+                continue
+            if author and pr["author"]["username"] != author.group(1):
+                continue
+            if reviewer and reviewer.group(1) not in {r["username"] for r in pr["reviewers"]}:
+                continue
+            base = f"{self.server.url}/2.0/repositories/bench/{repo}/pullrequests/{number}"
+            values.append(dict(pr, links={
+                "self": {"href": base},
+                "html": {"href": f"https://bitbucket.example/bench/{repo}/pull-requests/{number}"},
+                "comments": {"href": f"{base}/comments"},
+            }))
+        self.send_json(self.page(values, params, 50))
+
+
+class OllamaStub(StubHandler):
+    def handle_post(self, parsed, body):
+        if parsed.path not in ("/api/chat", "/api/generate"):
+            return super().handle_post(parsed, body)
+        request = json.loads(body or b"{}")
+        endpoint = parsed.path.rsplit("/", 1)[-1]
+        self.server.count(f"ollama.{endpoint}")
+        prompt = "".join(m.get("content", "") for m in request.get("messages", [])) or request.get("prompt", "")
+        time.sleep(len(prompt) / 1000 * self.server.options["ollama_ms_per_kchar"] / 1000)
+        answer = "1. Finish the most urgent item\n2. Review the oldest PR\n3. Follow up on blocked work"
+        if "Critical, Moderate or Minor" in prompt:
+            answer = "\n".join(f"{key}: Moderate" for key in re.findall(r"^([A-Z]+-\d+)\|", prompt, re.M))
+        done = {"model": request.get("model", "llama3"), "created_at": iso(datetime.now(timezone.utc)),
+                "done": True, "done_reason": "stop", "prompt_eval_count": len(prompt) // 4,
+                "eval_count": len(answer) // 4}
+        if endpoint == "generate":
+            return self.send_json(dict(done, response=""))
+        if not request.get("stream", True):
+            return self.send_json(dict(done, message={"role": "assistant", "content": answer}))
+
+        lines = [dict(done, done=False, message={"role": "assistant", "content": word + " "}) for word in answer.split(" ")]
+        lines.append(dict(done, message={"role": "assistant", "content": ""}))
+        payload = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class SlackStub(StubHandler):
+    def handle_post(self, parsed, body):
+        method = parsed.path.rsplit("/", 1)[-1]
+        self.server.count(f"slack.{method}")
+        every = self.server.options["slack_429_every"]
+        if method == "chat.postMessage" and every and self.server.counts[f"slack.{method}"] % every == 0:
+            self.server.count("slack.rate_limited")
+            return self.send_json({"ok": False, "error": "ratelimited"}, 429, {"Retry-After": "1"})
+        ts = f"{time.time():.6f}"
+        if method == "upload":
+            return self.send_json({"ok": True})
+        if method == "files.getUploadURLExternal":
+            return self.send_json({"ok": True, "upload_url": f"{self.server.url}/upload", "file_id": "FBENCH"})
+        if method == "files.completeUploadExternal":
+            return self.send_json({"ok": True, "files": [{"id": "FBENCH", "title": "bench"}]})
+        if method == "auth.test":
+            return self.send_json({"ok": True, "user_id": "UBOT", "bot_id": "BBOT", "team_id": "TBENCH", "url": self.server.url})
+        self.send_json({"ok": True, "channel": "CBENCH", "ts": ts, "message": {"ts": ts}})
+
+
+def fetch_counts(urls):
+    counts = Counter()
+    for url in urls:
+        with urllib.request.urlopen(f"{url}/_stats") as response:
+            counts.update(json.load(response))
+    return counts
+
+
+def run_command(command, result_path):
+    """Child-process entry point: import main against the stubs, run one command, write a JSON result."""
+    sys.path.insert(0, REPO_DIR)
+    import main
+
+    stub_urls = json.loads(os.environ["BENCH_STUB_URLS"])
+    user_id = main.ALLOWED_USERS[0]
+    channel_id = main.DIGEST_CHANNEL_ID
+
+    def say(text=None, channel=None, **kwargs):
+        return main.slack_client.chat_postMessage(channel=channel or channel_id, text=text, **kwargs)
+
+    def invoke(handler, text=""):
+        body = {"user_id": user_id, "channel_id": channel_id, "text": text}
+        handler(ack=lambda *args, **kwargs: None, body=body, say=say, client=main.slack_client)
+        main.job_queue.queue.join()
+
+    runners = {
+        "myday": lambda: invoke(main.daily_digest),
+        "teamday": lambda: invoke(main.team_digest),
+        "team-metrics": lambda: invoke(main.send_metrics_report),
+        "priority": lambda: invoke(main.classify_priorities),
+        "priority-me": lambda: invoke(main.classify_priorities, "me"),
+        # One slot shared by the whole team, delivered the way DigestScheduler does at digest_time
+        "scheduled": lambda: main.DigestScheduler(list(main.TEAM_OF)).deliver(tuple(main.TEAM_OF), datetime.now()),
+    }
+
+    before = fetch_counts(stub_urls)
+    tracemalloc.start()
+    start = time.perf_counter()
+    runners[command]()
+    wall = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    after = fetch_counts(stub_urls)
+
+    with open(result_path, "w") as f:
+        json.dump({"wall_s": wall, "peak_mb": peak / (1024 * 1024), "calls": dict(after - before)}, f)
+
+
+def run_scale(users, args):
+    dataset = build_dataset(users, args.repos, args.prs_per_repo, args.issues_per_user, args.comments_per_pr, args.seed)
+    options = {"ollama_ms_per_kchar": args.ollama_ms_per_kchar, "slack_429_every": args.slack_429_every}
+    servers = {
+        "jira": StubServer("jira", JiraStub, dataset, args.jira_latency_ms, options),
+        "bitbucket": StubServer("bitbucket", BitbucketStub, dataset, args.bitbucket_latency_ms, options),
+        "ollama": StubServer("ollama", OllamaStub, dataset, args.ollama_latency_ms, options),
+        "slack": StubServer("slack", SlackStub, dataset, args.slack_latency_ms, options),
+    }
+    for server in servers.values():
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            people = dataset["people"]
+            mappings = {
+                "useridtoemail.json": {p["slack_id"]: p["email"] for p in people},
+                "useridtobitbucket.json": {p["slack_id"]: p["username"] for p in people},
+                "user_preferences.json": {p["slack_id"]: {"digest_time": "09:00"} for p in people},
+            }
+            for name, content in mappings.items():
+                with open(os.path.join(workdir, name), "w") as f:
+                    json.dump(content, f)
+
+            env = dict(
+                os.environ,
+                SLACK_BOT_TOKEN="xoxb-bench",
+                SLACK_API_URL=f"{servers['slack'].url}/api/",
+                JIRA_BASE_URL=servers["jira"].url,
+                JIRA_API_TOKEN="bench",
+                BITBUCKET_API_URL=f"{servers['bitbucket'].url}/2.0",
+                BITBUCKET_WORKSPACE="bench",
+                BITBUCKET_APP_PASSWORD="bench",
+                BITBUCKET_REPOS=",".join(dataset["repos"]),
+                OLLAMA_HOST=servers["ollama"].url,
+                ALLOWED_USERS=",".join(p["slack_id"] for p in people),
+                DIGEST_CHANNEL_ID="CBENCH",
+                ACTIVITY_DB_PATH=os.path.join(workdir, "pr_activity.db"),
+                LLM_CACHE_DIR=os.path.join(workdir, "llm_cache"),
+                BENCH_STUB_URLS=json.dumps([s.url for s in servers.values()]),
+            )
+            # Production limits unless overridden, so limiter regressions show up in the numbers
+            if args.bitbucket_rate_limit is not None:
+                env["BITBUCKET_RATE_LIMIT_PER_HOUR"] = str(args.bitbucket_rate_limit)
+            for command in args.commands:
+                result_path = os.path.join(workdir, f"{command}.json")
+                subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--run-command", command, "--result", result_path],
+                    cwd=workdir, env=env, check=True,
+                    stdout=subprocess.DEVNULL if not args.verbose else None,
+                )
+                with open(result_path) as f:
+                    result = json.load(f)
+                result.update(users=users, command=command)
+                results.append(result)
+                print_result(result)
+    finally:
+        for server in servers.values():
+            server.shutdown()
+            server.server_close()
+    return results
+
+
+def print_result(result):
+    calls = result["calls"]
+    top = ", ".join(f"{k}={v}" for k, v in sorted(calls.items(), key=lambda kv: -kv[1]))
+    print(f"{result['users']:>6} {result['command']:<13} {result['wall_s']:>9.2f} {result['peak_mb']:>9.1f} "
+          f"{sum(calls.values()):>8}  {top}", flush=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", default="5,50,500", help="comma-separated team sizes")
+    parser.add_argument("--commands", default=",".join(COMMANDS), help=f"comma-separated subset of {COMMANDS}")
+    parser.add_argument("--repos", type=int, default=5)
+    parser.add_argument("--prs-per-repo", type=int, default=40)
+    parser.add_argument("--issues-per-user", type=int, default=10)
+    parser.add_argument("--comments-per-pr", type=int, default=8)
+    parser.add_argument("--jira-latency-ms", type=float, default=50)
+    parser.add_argument("--bitbucket-latency-ms", type=float, default=40)
+    parser.add_argument("--ollama-latency-ms", type=float, default=300)
+    parser.add_argument("--ollama-ms-per-kchar", type=float, default=100, help="extra Ollama latency per 1k prompt chars")
+    parser.add_argument("--slack-latency-ms", type=float, default=20)
+    parser.add_argument("--slack-429-every", type=int, default=0, help="answer every Nth chat.postMessage with a 429 (0 = never)")
+    parser.add_argument("--bitbucket-rate-limit", type=int, help="BITBUCKET_RATE_LIMIT_PER_HOUR for the run (default: main.py's, 0 = off)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write all results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own output")
+    parser.add_argument("--run-command", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.run_command:
+        run_command(args.run_command, args.result)
+        sys.exit(0)
+
+    args.commands = [c.strip() for c in args.commands.split(",") if c.strip()]
+    unknown = set(args.commands) - set(COMMANDS)
+    if unknown:
+        sys.exit(f"Unknown commands: {', '.join(sorted(unknown))}")
+
+    print(f"{'users':>6} {'command':<13} {'wall (s)':>9} {'peak MB':>9} {'requests':>8}  per endpoint")
+    all_results = []
+    for users in (int(u) for u in args.users.split(",")):
+        all_results += run_scale(users, args)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(all_results, f, indent=2)
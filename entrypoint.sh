@@ -3,9 +3,15 @@
 # 1. Start the Ollama server in the background
 ollama serve &
 
-# 2. Give it a few seconds to be ready
-sleep 5
+# 2. Wait until it answers (polling, not a fixed sleep); main.py preloads the model itself
+deadline=$(( $(date +%s) + ${OLLAMA_READY_TIMEOUT:-60} ))
+until curl -sf http://127.0.0.1:11434/api/version > /dev/null 2>&1; do
+  if [ "$(date +%s)" -ge "$deadline" ]; then
+    echo "⚠️ Ollama not ready after ${OLLAMA_READY_TIMEOUT:-60}s, starting the bot anyway"
+    break
+  fi
+  sleep 0.2
+done
 
 # 3. Now run the Slack‐Bolt bot
-python main.py
-
+exec python main.py
@@ -1,19 +1,48 @@
+import time
+_startup_started = _startup_clock = time.perf_counter()  # start of the startup-phase breakdown, before the slow imports
+
 from slack_bolt import App
-from slack_bolt.adapter.socket_mode import SocketModeHandler
 import requests
 import os
-import ollama
 import datetime
-import schedule
-import time
 import threading
 import json
 import csv
+import io
 import tempfile
 import re
-from datetime import datetime, timedelta
+import random
+import hashlib
+import hmac
+import heapq
+import queue
+import sqlite3
+import contextvars
+import multiprocessing
+import uuid
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+# Startup phases in seconds, in the order they completed; warm_up_llm adds its own (parallel) phases
+startup_phases = {}
+
+def startup_phase(name):
+    """Record the time since the previous phase ended as `name`."""
+    global _startup_clock
+    now = time.perf_counter()
+    startup_phases[name] = now - _startup_clock
+    _startup_clock = now
+
+startup_phase("imports")
 
 load_dotenv()
 
@@ -23,159 +52,1516 @@ with open("useridtoemail.json", "r") as f:
 with open("useridtobitbucket.json", "r") as f:
     SLACK_TO_BITBUCKET_USERNAME = json.load(f)
 
+try:
+    with open("user_preferences.json", "r") as f:
+        USER_PREFERENCES = json.load(f)
+except FileNotFoundError:
+    USER_PREFERENCES = {}
+# Per-team settings sit under a top-level "teams" key, next to the per-user entries
+TEAM_SETTINGS = USER_PREFERENCES.pop("teams", {})
+
 SLACK_BOT_TOKEN = os.getenv("SLACK_BOT_TOKEN")
 SLACK_APP_TOKEN = os.getenv("SLACK_APP_TOKEN")
+SLACK_API_URL = os.getenv("SLACK_API_URL", WebClient.BASE_URL)
 JIRA_API_TOKEN = os.getenv("JIRA_API_TOKEN")
 JIRA_EMAIL = os.getenv("JIRA_EMAIL")
 JIRA_BASE_URL = os.getenv("JIRA_BASE_URL")
 BITBUCKET_APP_PASSWORD = os.getenv("BITBUCKET_APP_PASSWORD")
 BITBUCKET_WORKSPACE = os.getenv("BITBUCKET_WORKSPACE")
+BITBUCKET_API_URL = os.getenv("BITBUCKET_API_URL", "https://api.bitbucket.org/2.0")
 BITBUCKET_REPOS = os.getenv("BITBUCKET_REPOS", "").split(",")
+BITBUCKET_USERNAME = os.getenv("BITBUCKET_USERNAME")
 ALLOWED_USERS = [u.strip() for u in os.getenv("ALLOWED_USERS", "").split(",")]
 DIGEST_CHANNEL_ID = os.getenv("DIGEST_CHANNEL_ID")
 
-
-slack_client = WebClient(token=SLACK_BOT_TOKEN)
-app = App(token=SLACK_BOT_TOKEN)
-
-def get_reviewer_review_time(pr, reviewer_username):
-    pr_id = pr['id']
-    repo_slug = pr['destination']['repository']['slug']
-    url = f"https://api.bitbucket.org/2.0/repositories/{BITBUCKET_WORKSPACE}/{repo_slug}/pullrequests/{pr_id}/activity"
-    response = requests.get(url, auth=(reviewer_username, BITBUCKET_APP_PASSWORD))
-    if response.status_code != 200:
+# Fan-out limits: total worker threads per fan-out, and in-flight requests per upstream host
+FETCH_MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", "16"))
+JIRA_MAX_CONCURRENCY = int(os.getenv("JIRA_MAX_CONCURRENCY", "4"))
+BITBUCKET_MAX_CONCURRENCY = int(os.getenv("BITBUCKET_MAX_CONCURRENCY", "8"))
+
+# Upstream HTTP behaviour: timeouts, retries with backoff, and client-side rate limits
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "15"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "4"))
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "60"))
+BITBUCKET_RATE_LIMIT_PER_HOUR = int(os.getenv("BITBUCKET_RATE_LIMIT_PER_HOUR", "1000"))
+# Bitbucket's quota is a rolling hour per user, so by default a user may spend all of it at once
+BITBUCKET_RATE_BURST = int(os.getenv("BITBUCKET_RATE_BURST", str(BITBUCKET_RATE_LIMIT_PER_HOUR)))
+JIRA_RATE_LIMIT_PER_MINUTE = int(os.getenv("JIRA_RATE_LIMIT_PER_MINUTE", "0"))  # 0 disables the limit
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Repo-level PR index: list every open PR once per repo and answer per-user lookups from memory
+BITBUCKET_PR_INDEX = os.getenv("BITBUCKET_PR_INDEX", "true").lower() == "true"
+
+# Upstream response cache: bounded LRU with a TTL (seconds) per data source
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+CACHE_TTLS = {
+    "jira": int(os.getenv("CACHE_TTL_JIRA", "120")),
+    "prs": int(os.getenv("CACHE_TTL_PRS", "120")),
+    "comments": int(os.getenv("CACHE_TTL_COMMENTS", "3600")),  # keyed on updated_on/comment_count
+    "activity": int(os.getenv("CACHE_TTL_ACTIVITY", "600")),
+}
+
+# Persisted PR activity store used for review-time metrics
+ACTIVITY_DB_PATH = os.getenv("ACTIVITY_DB_PATH", "pr_activity.db")
+ACTIVITY_RESYNC_HOURS = float(os.getenv("ACTIVITY_RESYNC_HOURS", "6"))
+REVIEW_TREND_WEEKS = int(os.getenv("REVIEW_TREND_WEEKS", "4"))
+
+# Ollama model and the on-disk cache of its outputs
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3")
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", ".llm_cache")
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "50"))
+LLM_CACHE_MAX_AGE_HOURS = float(os.getenv("LLM_CACHE_MAX_AGE_HOURS", "24"))
+
+# Ollama dispatch: in-flight requests (match the server's OLLAMA_NUM_PARALLEL), how long the model
+# stays loaded between requests (e.g. "30m", or -1 for forever), and whether to load it at startup
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", os.getenv("OLLAMA_NUM_PARALLEL", "1")))
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_KEEP_ALIVE = int(OLLAMA_KEEP_ALIVE) if OLLAMA_KEEP_ALIVE.lstrip("-").isdigit() else OLLAMA_KEEP_ALIVE
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "true").lower() == "true"
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "60"))
+OLLAMA_READY_TIMEOUT = float(os.getenv("OLLAMA_READY_TIMEOUT", "60"))
+
+# Digest pre-ranking: how many locally scored candidates go to the LLM, under a prompt token budget
+DIGEST_TOP_K = int(os.getenv("DIGEST_TOP_K", "8"))
+DIGEST_PROMPT_TOKEN_BUDGET = int(os.getenv("DIGEST_PROMPT_TOKEN_BUDGET", "600"))
+
+# /myday streaming: post the lists straight away and stream the Top 3 into a placeholder message
+DIGEST_STREAMING = os.getenv("DIGEST_STREAMING", "true").lower() == "true"
+STREAM_UPDATE_INTERVAL = float(os.getenv("STREAM_UPDATE_INTERVAL", "1.5"))
+
+# Digest mode: "full" re-sends everything, "delta" only what changed since the user's last digest
+# (overridable per user with "digest_mode" in user_preferences.json, or `/myday full|delta`)
+DIGEST_MODE = os.getenv("DIGEST_MODE", "full").lower()
+
+# Per-user digest scheduling: default slot, how early to pre-render, and pre-render concurrency
+DEFAULT_DIGEST_TIME = os.getenv("DEFAULT_DIGEST_TIME", "09:00")
+DIGEST_PREFETCH_MINUTES = float(os.getenv("DIGEST_PREFETCH_MINUTES", "10"))
+DIGEST_PREFETCH_WORKERS = int(os.getenv("DIGEST_PREFETCH_WORKERS", "2"))
+
+# Teams: users join one with "team" in user_preferences.json (everyone else is on DEFAULT_TEAM), and each
+# team's digest_channel, repos and digest_time under its "teams" key override the single-team settings above.
+# TEAM_WORKERS > 0 runs team work on that many worker processes, sharded by team.
+DEFAULT_TEAM = os.getenv("DEFAULT_TEAM", "default")
+TEAM_WORKERS = int(os.getenv("TEAM_WORKERS", "0"))
+
+# Background job queue that slash commands hand their work to
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "32"))
+
+# Telemetry: Prometheus-style /metrics endpoint (port 0 disables it) and JSON logs per command
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+LOG_JSON = os.getenv("LOG_JSON", "false").lower() == "true"
+
+# Webhook ingestion: Jira/Bitbucket webhook receiver (port 0 disables it) signed with WEBHOOK_SECRET,
+# feeding an in-memory work index that is fully reconciled against the APIs every few minutes
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "0"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_BYTES = int(os.getenv("WEBHOOK_MAX_BYTES", str(5 * 1024 * 1024)))  # larger bodies get 413 unread
+WEBHOOK_RECORD_PATH = os.getenv("WEBHOOK_RECORD_PATH")  # append received payloads here for replay_webhooks.py
+WORK_INDEX_RECONCILE_MINUTES = float(os.getenv("WORK_INDEX_RECONCILE_MINUTES", "15"))
+
+# Slack delivery: chat.postMessage allows about one message per second per channel (with short bursts);
+# channels are delivered in parallel and 429s are retried after Retry-After
+SLACK_CHANNEL_RATE_PER_SECOND = float(os.getenv("SLACK_CHANNEL_RATE_PER_SECOND", "1"))
+SLACK_CHANNEL_BURST = int(os.getenv("SLACK_CHANNEL_BURST", "3"))
+SLACK_MAX_RETRIES = int(os.getenv("SLACK_MAX_RETRIES", "5"))
+SLACK_DELIVERY_WORKERS = int(os.getenv("SLACK_DELIVERY_WORKERS", "4"))
+
+# /team-metrics: how many recent reports (and for how long) the export button can re-export from memory
+REPORT_STORE_MAX = int(os.getenv("REPORT_STORE_MAX", "20"))
+REPORT_STORE_TTL_HOURS = float(os.getenv("REPORT_STORE_TTL_HOURS", "24"))
+
+# Jira search: page size, projected fields, assignees per batched query and the priorities the team-wide /priority reports
+JIRA_PAGE_SIZE = int(os.getenv("JIRA_PAGE_SIZE", "100"))
+JIRA_FIELDS = "summary,status,priority,duedate"
+JIRA_ASSIGNEE_BATCH = int(os.getenv("JIRA_ASSIGNEE_BATCH", "50"))
+CRITICAL_PRIORITIES = [p.strip() for p in os.getenv("CRITICAL_PRIORITIES", "High,Major,Immediate").split(",") if p.strip()]
+
+# /priority me: Jira priorities that decide the label without the LLM, and issues per LLM request
+MINOR_PRIORITIES = [p.strip() for p in os.getenv("MINOR_PRIORITIES", "Low,Lowest,Minor,Trivial").split(",") if p.strip()]
+PRIORITY_BATCH_SIZE = int(os.getenv("PRIORITY_BATCH_SIZE", "20"))
+
+class Team:
+    """A team on the roster: its members, the Bitbucket repos it works in, its digest channel and default slot."""
+
+    def __init__(self, name, user_ids, repos, digest_channel, digest_time):
+        self.name = name
+        self.user_ids = user_ids
+        self.repos = repos
+        self.digest_channel = digest_channel
+        self.digest_time = digest_time
+
+def build_roster():
+    """Group ALLOWED_USERS and every user with a "team" preference into Teams, keyed by team name."""
+    members = {}
+    for user_id in dict.fromkeys(ALLOWED_USERS + [u for u, prefs in USER_PREFERENCES.items() if prefs.get("team")]):
+        if user_id:
+            members.setdefault(USER_PREFERENCES.get(user_id, {}).get("team") or DEFAULT_TEAM, []).append(user_id)
+    teams = {}
+    for name, user_ids in members.items():
+        settings = TEAM_SETTINGS.get(name, {})
+        repos = settings.get("repos") or BITBUCKET_REPOS
+        if isinstance(repos, str):
+            repos = repos.split(",")
+        teams[name] = Team(name, user_ids, [r.strip() for r in repos if r.strip()],
+                           settings.get("digest_channel") or DIGEST_CHANNEL_ID,
+                           settings.get("digest_time") or DEFAULT_DIGEST_TIME)
+    return teams
+
+TEAMS = build_roster()
+TEAM_OF = {user_id: team for team in TEAMS.values() for user_id in team.user_ids}
+# Repos this process scans for PRs: every team's, narrowed to its own teams' in a team worker
+BITBUCKET_REPOS = sorted({repo for team in TEAMS.values() for repo in team.repos})
+
+startup_phase("config")
+
+slack_client = WebClient(token=SLACK_BOT_TOKEN, base_url=SLACK_API_URL)
+# Bolt builds its own client for the real Slack API; a custom SLACK_API_URL (e.g. a local stub) needs ours
+app = App(token=SLACK_BOT_TOKEN) if SLACK_API_URL == WebClient.BASE_URL else App(client=slack_client)
+startup_phase("slack_app")
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+class Metrics:
+    """Thread-safe counters and histograms rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.histograms = {}
+        self.collectors = []
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(key, {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["counts"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def collector(self, fn):
+        """Register fn() -> [(name, labels, value)] to be sampled as gauges on every scrape."""
+        self.collectors.append(fn)
+        return fn
+
+    def samples(self):
+        """Every current sample as (name, sorted label pairs, value), collectors included."""
+        samples = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                samples.append((name, labels, value))
+            for (name, labels), h in sorted(self.histograms.items()):
+                for bound, count in zip(h["buckets"], h["counts"]):
+                    samples.append((f"{name}_bucket", labels + (("le", bound),), count))
+                samples.append((f"{name}_bucket", labels + (("le", "+Inf"),), h["count"]))
+                samples.append((f"{name}_sum", labels, h["sum"]))
+                samples.append((f"{name}_count", labels, h["count"]))
+        for collect in self.collectors:
+            try:
+                for name, labels, value in collect():
+                    samples.append((name, tuple(sorted(labels.items())), value))
+            except Exception as e:
+                print(f"⚠️ Metrics collector {collect.__name__} failed: {e}")
+        return samples
+
+    def render(self):
+        def fmt(labels):
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+        return "".join(f"{name}{fmt(labels)} {value}\n" for name, labels, value in self.samples())
+
+metrics = Metrics()
+_invocation = contextvars.ContextVar("invocation", default=None)
+
+@contextmanager
+def span(stage):
+    """Time a stage into digest_stage_seconds and the current command's span breakdown."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe("digest_stage_seconds", elapsed, stage=stage)
+        invocation = _invocation.get()
+        if invocation is not None:
+            with invocation["lock"]:
+                invocation["spans"][stage] = invocation["spans"].get(stage, 0.0) + elapsed
+
+@contextmanager
+def command_invocation(command, **fields):
+    """Record one command run: duration, status and span breakdown (logged as JSON when LOG_JSON is set)."""
+    invocation = {"spans": {}, "lock": threading.Lock()}
+    token = _invocation.set(invocation)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _invocation.reset(token)
+        metrics.observe("command_duration_seconds", duration, command=command)
+        metrics.inc("commands_total", command=command, status=status)
+        if LOG_JSON:
+            print(json.dumps({
+                "event": "command", "command": command, "status": status, "duration_s": round(duration, 3),
+                "spans": {k: round(v, 3) for k, v in invocation["spans"].items()},
+                "ts": datetime.now(timezone.utc).isoformat(), **fields,
+            }), flush=True)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_metrics_server():
+    if not METRICS_PORT:
         return None
+    server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"📈 Serving metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return server
+
+class TokenBucket:
+    """Blocking token bucket: `rate` tokens per second, bursting up to `capacity`.
+
+    Built with a multiprocessing `context`, it is shared with the processes it is passed to.
+    """
+
+    def __init__(self, rate, capacity, context=None):
+        self.rate = rate
+        self.capacity = capacity
+        # [tokens, last refill]; time.monotonic is system-wide, so processes agree on it
+        self.state = context.Array("d", [capacity, time.monotonic()]) if context else [capacity, time.monotonic()]
+        self.lock = self.state.get_lock() if context else threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                tokens = min(self.capacity, self.state[0] + (now - self.state[1]) * self.rate)
+                self.state[1] = now
+                if tokens >= 1:
+                    self.state[0] = tokens - 1
+                    return
+                self.state[0] = tokens
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+
+_host_clients = {}
+_rate_buckets = {}
+_host_clients_lock = threading.Lock()
+# Share of the Bitbucket/Jira rate limits this process may use; team workers split them with the main process
+_rate_share = 1.0
+
+def _host_limit(host):
+    if JIRA_BASE_URL and host == urlparse(JIRA_BASE_URL).netloc:
+        return JIRA_MAX_CONCURRENCY
+    if host == urlparse(BITBUCKET_API_URL).netloc:
+        return BITBUCKET_MAX_CONCURRENCY
+    return FETCH_MAX_WORKERS
+
+def _host_bucket(host):
+    if host == urlparse(BITBUCKET_API_URL).netloc and BITBUCKET_RATE_LIMIT_PER_HOUR > 0:
+        return TokenBucket(BITBUCKET_RATE_LIMIT_PER_HOUR * _rate_share / 3600, max(1, BITBUCKET_RATE_BURST * _rate_share))
+    if JIRA_BASE_URL and host == urlparse(JIRA_BASE_URL).netloc and JIRA_RATE_LIMIT_PER_MINUTE > 0:
+        return TokenBucket(JIRA_RATE_LIMIT_PER_MINUTE * _rate_share / 60, max(1, JIRA_RATE_LIMIT_PER_MINUTE * _rate_share))
+    return None
 
-    activities = response.json().get("values", [])
-    added_time = None
-    reviewed_time = None
-
-    for activity in activities:
-        ts = activity.get("created_on")
-        user = activity.get("user", {}).get("username")
-        action_type = activity.get("approval") or activity.get("comment") or {}
-
-        # Check if reviewer was added
-        update = activity.get("update", {})
-        reviewers = update.get("reviewers", [])
-        for r in reviewers:
-            if r.get("username") == reviewer_username and not added_time:
-                added_time = ts
-
-        # Check if reviewer took any action
-        if user == reviewer_username:
-            if activity.get("approval") or activity.get("comment"):
-                reviewed_time = ts
+def _host_client(url):
+    """Return the (session, semaphore) shared by every call to this URL's host."""
+    host = urlparse(url).netloc
+    with _host_clients_lock:
+        if host not in _host_clients:
+            limit = _host_limit(host)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=limit)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _host_clients[host] = (session, threading.BoundedSemaphore(limit))
+        return _host_clients[host]
+
+def _rate_bucket(host, auth):
+    """Return the token bucket for this host and authenticated user: upstream quotas are per user."""
+    key = (host, auth[0] if isinstance(auth, tuple) else None)
+    with _host_clients_lock:
+        if key not in _rate_buckets:
+            _rate_buckets[key] = _host_bucket(host)
+        return _rate_buckets[key]
+
+def _retry_delay(response, attempt):
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds()
+                return min(max(delay, 0), HTTP_BACKOFF_MAX)
+            except (TypeError, ValueError):
+                pass
+    return min(HTTP_BACKOFF_BASE * 2 ** attempt, HTTP_BACKOFF_MAX) * random.uniform(0.5, 1.0)
+
+def http_get(url, **kwargs):
+    """GET an upstream URL over a pooled per-host session.
+
+    Retries connection errors, 429 and 5xx responses with exponential backoff (honouring
+    Retry-After) and raises requests.HTTPError once retries are exhausted.
+    """
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    host = urlparse(url).netloc
+    session, semaphore = _host_client(url)
+    bucket = _rate_bucket(host, kwargs.get("auth"))
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        if bucket:
+            bucket.acquire()
+        response = None
+        metrics.inc("upstream_requests_total", host=host)
+        start = time.perf_counter()
+        try:
+            with semaphore:
+                response = session.get(url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            metrics.inc("upstream_errors_total", host=host, reason=type(e).__name__)
+            if attempt == HTTP_MAX_RETRIES:
+                raise
+        else:
+            metrics.observe("upstream_request_seconds", time.perf_counter() - start, host=host)
+            if response.status_code >= 400:
+                metrics.inc("upstream_errors_total", host=host, reason=str(response.status_code))
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            if attempt == HTTP_MAX_RETRIES:
+                response.raise_for_status()
+        metrics.inc("upstream_retries_total", host=host)
+        delay = _retry_delay(response, attempt)
+        print(f"⏳ Retrying {urlparse(url).netloc} in {delay:.1f}s (attempt {attempt + 1})")
+        time.sleep(delay)
+
+class TTLCache:
+    """LRU cache with per-entry expiry and single-flight fetching.
+
+    Concurrent misses on the same key wait for one in-flight fetch instead of each calling upstream.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = Counter()
+        self.misses = Counter()
+        self.coalesced = Counter()
+
+    def get_or_fetch(self, source, key, fetch, ttl):
+        full_key = (source, key)
+        with self.lock:
+            entry = self.entries.get(full_key)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(full_key)
+                self.hits[source] += 1
+                return entry[1]
+            flight = self.inflight.get(full_key)
+            owner = flight is None
+            if owner:
+                self.misses[source] += 1
+                flight = self.inflight[full_key] = Future()
+            else:
+                self.coalesced[source] += 1
+        if not owner:
+            return flight.result()
 
-    if added_time and reviewed_time:
-        start = datetime.strptime(added_time, "%Y-%m-%dT%H:%M:%S.%f%z")
-        end = datetime.strptime(reviewed_time, "%Y-%m-%dT%H:%M:%S.%f%z")
-        return round((end - start).total_seconds() / (60 * 60 * 24), 2)
+        try:
+            value = fetch()
+        except Exception as e:
+            with self.lock:
+                self.inflight.pop(full_key, None)
+            flight.set_exception(e)
+            raise
+
+        with self.lock:
+            # Failed fetches return None and are not cached
+            if value is not None:
+                self.entries[full_key] = (time.monotonic() + ttl, value)
+                self.entries.move_to_end(full_key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            self.inflight.pop(full_key, None)
+        flight.set_result(value)
+        return value
+
+    def invalidate(self, sources=None):
+        with self.lock:
+            for full_key in list(self.entries):
+                if sources is None or full_key[0] in sources:
+                    del self.entries[full_key]
+
+    def stats(self):
+        with self.lock:
+            sizes = Counter(source for source, _ in self.entries)
+            return {
+                source: {
+                    "hits": self.hits[source],
+                    "misses": self.misses[source],
+                    "coalesced": self.coalesced[source],
+                    "entries": sizes[source],
+                }
+                for source in CACHE_TTLS
+            }
+
+upstream_cache = TTLCache(CACHE_MAX_ENTRIES)
+
+def cached_fetch(source, key, fetch):
+    return upstream_cache.get_or_fetch(source, key, fetch, CACHE_TTLS[source])
+
+def wants_refresh(body):
+    """True when a slash command was invoked with a `refresh` argument, e.g. `/teamday refresh`."""
+    return "refresh" in (body.get("text") or "").lower().split()
+
+class JobQueue:
+    """Bounded worker pool for slash-command work; a key already queued or running is coalesced."""
+
+    def __init__(self, workers, max_size):
+        self.workers = workers
+        self.max_size = max_size
+        self.queue = queue.Queue()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.started = False
+        self.runtimes = {}
+        self.counts = Counter()
+
+    def _start(self):
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True).start()
+        self.started = True
+
+    def submit(self, key, name, job, prepare=None):
+        """Queue job(context), where context = prepare() runs first on the caller's thread.
+
+        Returns False when coalesced into an in-flight job; raises queue.Full when the queue is full.
+        """
+        with self.lock:
+            if key in self.inflight:
+                self.counts["coalesced"] += 1
+                return False
+            if self.queue.qsize() >= self.max_size:
+                self.counts["rejected"] += 1
+                raise queue.Full
+            self.inflight[key] = name
+            if not self.started:
+                self._start()
+        try:
+            context = prepare() if prepare else None
+        except Exception:
+            with self.lock:
+                self.inflight.pop(key, None)
+            raise
+        self.queue.put((key, name, job, context, time.monotonic()))
+        self.counts["submitted"] += 1
+        return True
+
+    def _work(self):
+        while True:
+            key, name, job, context, enqueued = self.queue.get()
+            start = time.monotonic()
+            metrics.observe("job_queue_wait_seconds", start - enqueued, command=name)
+            try:
+                job(context)
+            except Exception as e:
+                self.counts["failed"] += 1
+                print(f"❌ Job {name} failed: {e}")
+                if callable(context):
+                    try:
+                        context(f"❌ Sorry, {name} failed. Please try again.")
+                    except Exception:
+                        pass
+            finally:
+                with self.lock:
+                    self.inflight.pop(key, None)
+                    self.runtimes.setdefault(name, deque(maxlen=100)).append(time.monotonic() - start)
+                self.queue.task_done()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "depth": self.queue.qsize(),
+                "in_flight": len(self.inflight),
+                "counts": dict(self.counts),
+                "runtimes": {
+                    name: {"count": len(r), "avg": sum(r) / len(r), "max": max(r)}
+                    for name, r in self.runtimes.items() if r
+                },
+            }
+
+job_queue = JobQueue(JOB_WORKERS, JOB_QUEUE_SIZE)
+
+def submit_command_job(client, body, key, name, working_text, job, channel=None):
+    """Post a "working…" message and run job(update) on the job queue.
+
+    update(text, blocks=None) edits the working message in place. Identical in-flight requests
+    are coalesced and the requester is told so ephemerally.
+    """
+    channel = channel or body['channel_id']
+
+    def prepare():
+        response = slack_delivery.post(channel, working_text, None).result()
+
+        def update(text, blocks=None):
+            slack_delivery.update(response["channel"], response["ts"], text, blocks).result()
+        return update
+
+    def run(update):
+        with command_invocation(name, user=body['user_id'], channel=channel):
+            job(update)
 
+    try:
+        accepted = job_queue.submit(key, name, run, prepare)
+    except queue.Full:
+        client.chat_postEphemeral(channel=body['channel_id'], user=body['user_id'],
+                                  text="🚦 The bot is busy right now, please try again in a minute.")
+        return
+    if not accepted:
+        client.chat_postEphemeral(channel=body['channel_id'], user=body['user_id'],
+                                  text="⏳ The same request is already running here, its result will appear shortly.")
+
+def fan_out(fn, items, max_workers=None):
+    """Run fn over items concurrently and return the results in input order."""
+    items = list(items)
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    workers = min(max_workers or FETCH_MAX_WORKERS, len(items))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # Carry the caller's context so spans in worker threads land on the same command
+        futures = [pool.submit(contextvars.copy_context().run, fn, item) for item in items]
+        return [future.result() for future in futures]
+
+def fetch_user_work(jira_email, bitbucket_username, jira_issues=None):
+    """Fetch a user's Jira issues, authored PRs and review PRs in parallel.
+
+    Pass jira_issues when they already came from a team-wide search. A source whose fetch failed
+    comes back as None rather than [], so callers can tell a failure from "nothing open".
+    """
+    def fetch_jira():
+        with span("fetch.jira"):
+            return get_jira_issues(jira_email) if jira_issues is None else jira_issues
+
+    def fetch_authored():
+        with span("fetch.authored_prs"):
+            return get_user_created_prs(bitbucket_username)
+
+    def fetch_review():
+        with span("fetch.review_prs"):
+            return get_user_review_prs(bitbucket_username)
+
+    jira_issues, user_prs, review_prs = fan_out(lambda fetch: fetch(), [fetch_jira, fetch_authored, fetch_review])
+    return jira_issues, user_prs, review_prs
+
+_activity_db = None
+_activity_db_lock = threading.Lock()
+
+def activity_db():
+    global _activity_db
+    with _activity_db_lock:
+        if _activity_db is None:
+            _activity_db = sqlite3.connect(ACTIVITY_DB_PATH, check_same_thread=False)
+            _activity_db.executescript("""
+                CREATE TABLE IF NOT EXISTS pr_events (
+                    repo TEXT, pr_id INTEGER, kind TEXT, ts TEXT, actor TEXT, reviewers TEXT,
+                    PRIMARY KEY (repo, pr_id, kind, ts, actor)
+                );
+                CREATE TABLE IF NOT EXISTS pr_sync (
+                    repo TEXT, pr_id INTEGER, watermark TEXT, updated_on TEXT, synced_at REAL,
+                    PRIMARY KEY (repo, pr_id)
+                );
+                CREATE TABLE IF NOT EXISTS review_times (
+                    repo TEXT, pr_id INTEGER, reviewer TEXT, added_at TEXT, reviewed_at TEXT, days REAL,
+                    PRIMARY KEY (repo, pr_id, reviewer)
+                );
+                CREATE TABLE IF NOT EXISTS issue_labels (
+                    issue_key TEXT PRIMARY KEY, content_hash TEXT, label TEXT, labelled_at REAL
+                );
+                CREATE TABLE IF NOT EXISTS digest_snapshots (
+                    user_id TEXT PRIMARY KEY, snapshot TEXT, delivered_at REAL
+                );
+            """)
+        return _activity_db
+
+def parse_bitbucket_ts(ts):
+    return datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S.%f%z")
+
+def bitbucket_ts_array(timestamps):
+    """Parse Bitbucket timestamps (always UTC) into a datetime64[s] array in one call."""
+    import numpy as np
+    return np.array([ts[:19] for ts in timestamps], dtype="datetime64[s]")
+
+def normalize_activity(activity):
+    """Flatten a Bitbucket activity entry into (kind, timestamp, actor, reviewer usernames)."""
+    update = activity.get("update")
+    if update:
+        actor = bitbucket_user_key(update.get("author") or activity.get("user"))
+        reviewers = [bitbucket_user_key(r) for r in update.get("reviewers", [])]
+        return "update", update.get("date") or activity.get("created_on"), actor, reviewers
+    for kind in ("approval", "comment"):
+        if activity.get(kind):
+            event = activity[kind] if isinstance(activity[kind], dict) else {}
+            ts = event.get("date") or event.get("created_on") or activity.get("created_on")
+            return kind, ts, bitbucket_user_key(event.get("user") or activity.get("user")), []
     return None
 
-def safe_trim(text, limit=2900):
-    """Safely trim long text at the last paragraph boundary."""
-    if len(text) <= limit:
-        return text
-    cutoff = text[:limit].rfind("\n\n")
-    cutoff = cutoff if cutoff != -1 else limit
-    return text[:cutoff].rstrip() + "\n\n_⚠️ Truncated: Digest was too long_"
+def sync_pr_activity(repo_slug, pr, username):
+    """Store activity events newer than this PR's watermark.
 
-def get_jira_issues(user_email):
+    PRs whose `updated_on` matches the last sync are skipped without an API call until
+    ACTIVITY_RESYNC_HOURS have passed. Returns False if Bitbucket refused the request.
+    """
+    pr_id = pr['id']
+    db = activity_db()
+    with _activity_db_lock:
+        row = db.execute("SELECT watermark, updated_on, synced_at FROM pr_sync WHERE repo = ? AND pr_id = ?",
+                         (repo_slug, pr_id)).fetchone()
+    watermark, updated_on, synced_at = row or (None, None, 0)
+    if updated_on and updated_on == pr.get("updated_on") and time.time() - synced_at < ACTIVITY_RESYNC_HOURS * 3600:
+        return True
+
+    url = f"{BITBUCKET_API_URL}/repositories/{BITBUCKET_WORKSPACE}/{repo_slug}/pullrequests/{pr_id}/activity"
+    params = {"pagelen": 50}
+    events = []
+    while url:
+        response = http_get(url, params=params, auth=(username, BITBUCKET_APP_PASSWORD))
+        if response.status_code != 200:
+            return False
+        data = response.json()
+        reached_watermark = False
+        # The feed is newest-first, so stop paging at the first event we already have
+        for activity in data.get("values", []):
+            event = normalize_activity(activity)
+            if not event or not event[1] or not event[2]:
+                continue
+            if watermark and event[1] <= watermark:
+                reached_watermark = True
+                break
+            events.append(event)
+        url = None if reached_watermark else data.get("next")
+        params = None
+
+    new_watermark = max([watermark or ""] + [event[1] for event in events]) or None
+    with _activity_db_lock, db:
+        db.executemany("INSERT OR IGNORE INTO pr_events VALUES (?, ?, ?, ?, ?, ?)",
+                       [(repo_slug, pr_id, kind, ts, actor, json.dumps(reviewers)) for kind, ts, actor, reviewers in events])
+        db.execute("INSERT OR REPLACE INTO pr_sync VALUES (?, ?, ?, ?, ?)",
+                   (repo_slug, pr_id, new_watermark, pr.get("updated_on"), time.time()))
+    return True
+
+def stored_review_time(repo_slug, pr_id, reviewer_username):
+    """Days from the reviewer being added to their first approval or comment, from stored events."""
+    return stored_review_times([(repo_slug, pr_id, reviewer_username)])[0]
+
+def stored_review_times(keys):
+    """stored_review_time for many (repo, PR id, reviewer) keys: one events query per repo, days computed in batch."""
+    import numpy as np
+    pr_ids = {}
+    for repo_slug, pr_id, _ in keys:
+        pr_ids.setdefault(repo_slug, set()).add(pr_id)
+
+    events = {}
+    db = activity_db()
+    with _activity_db_lock:
+        for repo_slug, ids in pr_ids.items():
+            ids = sorted(ids)
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                for pr_id, kind, ts, actor, reviewers in db.execute(
+                        f"SELECT pr_id, kind, ts, actor, reviewers FROM pr_events WHERE repo = ? AND pr_id IN ({','.join('?' * len(chunk))}) ORDER BY ts",
+                        [repo_slug, *chunk]):
+                    events.setdefault((repo_slug, pr_id), []).append((kind, ts, actor, json.loads(reviewers) if kind == "update" else ()))
+
+    found = {}
+    for repo_slug, pr_id, reviewer_username in keys:
+        added_at = None
+        for kind, ts, actor, reviewers in events.get((repo_slug, pr_id), ()):
+            if kind == "update" and not added_at and reviewer_username in reviewers:
+                added_at = ts
+            elif kind in ("approval", "comment") and actor == reviewer_username and added_at:
+                found[(repo_slug, pr_id, reviewer_username)] = (added_at, ts)
+                break
+    if not found:
+        return [None] * len(keys)
+
+    added, reviewed = zip(*found.values())
+    days = (bitbucket_ts_array(reviewed) - bitbucket_ts_array(added)) / np.timedelta64(1, "D")
+    days = dict(zip(found, days.tolist()))
+    with _activity_db_lock, db:
+        db.executemany("INSERT OR REPLACE INTO review_times VALUES (?, ?, ?, ?, ?, ?)",
+                       [(*key, added_at, reviewed_at, days[key]) for key, (added_at, reviewed_at) in found.items()])
+    return [days.get(key) for key in keys]
+
+def ensure_pr_activity(repo_slug, pr, username):
+    """Sync a PR's activity at most once per activity-cache TTL; False if Bitbucket refused it."""
+    def sync():
+        with span("bitbucket.activity"):
+            return sync_pr_activity(repo_slug, pr, username) or None
+
+    return bool(cached_fetch("activity", (repo_slug, pr['id']), sync))
+
+def get_pr_review_time(repo_slug, pr, reviewer_username):
+    if not ensure_pr_activity(repo_slug, pr, reviewer_username):
+        return None
+    return stored_review_time(repo_slug, pr['id'], reviewer_username)
+
+def review_time_trend(reviewer_username, weeks=REVIEW_TREND_WEEKS):
+    """Average review time per week for the last `weeks` weeks, oldest first (None for empty weeks)."""
+    db = activity_db()
+    with _activity_db_lock:
+        rows = db.execute("SELECT reviewed_at, days FROM review_times WHERE reviewer = ?", (reviewer_username,)).fetchall()
+
+    now = datetime.now(timezone.utc)
+    buckets = [[] for _ in range(weeks)]
+    for reviewed_at, days in rows:
+        age_weeks = (now - parse_bitbucket_ts(reviewed_at)).days // 7
+        if 0 <= age_weeks < weeks:
+            buckets[weeks - 1 - age_weeks].append(days)
+    return [round(sum(b) / len(b), 1) if b else None for b in buckets]
+
+def get_reviewer_review_time(pr, reviewer_username):
+    repo_slug = pr['destination']['repository']['slug']
+    review_time = get_pr_review_time(repo_slug, pr, reviewer_username)
+    return round(review_time, 2) if review_time is not None else None
+
+llm_cache_stats = Counter()
+_llm_cache_lock = threading.Lock()
+
+def llm_cache_key(model, kind, *inputs):
+    """Hash the model, prompt kind and whitespace-normalized prompt inputs."""
+    normalized = [re.sub(r"\s+", " ", text or "").strip() for text in inputs]
+    return hashlib.sha256(json.dumps([model, kind] + normalized).encode("utf-8")).hexdigest()
+
+def evict_llm_cache():
+    """Drop entries older than LLM_CACHE_MAX_AGE_HOURS, then the oldest until under LLM_CACHE_MAX_MB."""
+    with _llm_cache_lock:
+        entries = []
+        for entry in os.scandir(LLM_CACHE_DIR):
+            if entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        cutoff = time.time() - LLM_CACHE_MAX_AGE_HOURS * 3600
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in entries:
+            if mtime >= cutoff and total <= LLM_CACHE_MAX_MB * 1024 * 1024:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            llm_cache_stats["evictions"] += 1
+
+# Replaced by one shared with the team workers when they run, so the cap holds across processes
+_ollama_slots = threading.BoundedSemaphore(OLLAMA_MAX_CONCURRENCY)
+_ollama_clients = {}
+_ollama_clients_lock = threading.Lock()
+
+def ollama_client(timeout=OLLAMA_TIMEOUT):
+    """Shared Ollama client per timeout; `ollama` (and httpx) is only imported on first use.
+
+    Chat requests give up after OLLAMA_TIMEOUT so callers can fall back; the warm-up may take longer.
+    """
+    with _ollama_clients_lock:
+        if timeout not in _ollama_clients:
+            import ollama
+            _ollama_clients[timeout] = ollama.Client(timeout=timeout)
+        return _ollama_clients[timeout]
+
+def llm_chat(prompt, kind, model=OLLAMA_MODEL, on_update=None):
+    """Send one chat request to Ollama once one of the OLLAMA_MAX_CONCURRENCY slots is free.
+
+    Requests beyond Ollama's parallel slots would only queue inside the server, so they wait here
+    instead, where the wait is visible as the llm.queue span.
+    """
+    messages = [{"role": "user", "content": prompt}]
+    response = None
+    # Partial updates are Slack calls, so they run on their own thread rather than stall a held slot;
+    # one still in flight means the next interval's (longer) text goes out instead
+    updater = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm-update") if on_update else None
+    pending_update = None
+    with span("llm.queue"):
+        _ollama_slots.acquire()
+    try:
+        start = time.monotonic()
+        with span("llm"):
+            if on_update is None:
+                response = ollama_client().chat(model=model, messages=messages, keep_alive=OLLAMA_KEEP_ALIVE)
+                content = response['message']['content']
+            else:
+                parts = []
+                last_update = time.monotonic()
+                for response in ollama_client().chat(model=model, messages=messages, stream=True, keep_alive=OLLAMA_KEEP_ALIVE):
+                    parts.append(response['message']['content'])
+                    if time.monotonic() - last_update >= STREAM_UPDATE_INTERVAL and (pending_update is None or pending_update.done()):
+                        pending_update = updater.submit(contextvars.copy_context().run, on_update, "".join(parts))
+                        last_update = time.monotonic()
+                content = "".join(parts)
+    finally:
+        _ollama_slots.release()
+        if updater:
+            updater.shutdown(wait=True)
+    metrics.observe("llm_request_seconds", time.monotonic() - start, model=model, kind=kind)
+    # The final (or only) response carries the token counts; an empty stream has none.
+    for token_type, field in (("prompt", "prompt_eval_count"), ("completion", "eval_count")):
+        count = (response or {}).get(field)
+        if count:
+            metrics.observe("llm_tokens", count, buckets=TOKEN_BUCKETS, model=model, type=token_type)
+    return content
+
+def wait_for_ollama(timeout=OLLAMA_READY_TIMEOUT):
+    """Poll Ollama until it answers; False if it is still down after `timeout` seconds."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            ollama_client(timeout=2).ps()
+            return True
+        except Exception:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.25)
+
+def warm_up_llm(model=OLLAMA_MODEL):
+    """Load the model into Ollama ahead of the first command (an empty prompt only loads it)."""
+    start = time.perf_counter()
+    try:
+        if not wait_for_ollama():
+            print(f"⚠️ Ollama not reachable after {OLLAMA_READY_TIMEOUT:.0f}s, skipping model warm-up")
+            return
+        ready = time.perf_counter()
+        ollama_client(timeout=None).generate(model=model, prompt="", keep_alive=OLLAMA_KEEP_ALIVE)
+        startup_phases["ollama_ready"] = ready - start
+        startup_phases["model_load"] = time.perf_counter() - ready
+        print(f"🔥 Loaded {model} in {startup_phases['model_load']:.1f}s (Ollama ready after {startup_phases['ollama_ready']:.1f}s)")
+    except Exception as e:
+        print(f"⚠️ Could not warm up {model}: {e}")
+
+def cached_llm_chat(prompt, kind, inputs, model=OLLAMA_MODEL, on_update=None):
+    """Return the LLM answer for prompt, reusing a stored answer when the inputs are unchanged.
+
+    With on_update, a cache miss is streamed and on_update(partial_answer) is called at most
+    every STREAM_UPDATE_INTERVAL seconds.
+    """
+    path = os.path.join(LLM_CACHE_DIR, llm_cache_key(model, kind, *inputs) + ".json")
+    try:
+        if time.time() - os.path.getmtime(path) < LLM_CACHE_MAX_AGE_HOURS * 3600:
+            with open(path, "r") as f:
+                content = json.load(f)["content"]
+            with _llm_cache_lock:
+                llm_cache_stats["hits"] += 1
+            return content
+    except (OSError, ValueError, KeyError):
+        pass
+
+    with _llm_cache_lock:
+        llm_cache_stats["misses"] += 1
+    content = llm_chat(prompt, kind, model, on_update)
+
+    os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", dir=LLM_CACHE_DIR, suffix=".tmp", delete=False) as tmpfile:
+        json.dump({"model": model, "kind": kind, "created_at": time.time(), "content": content}, tmpfile)
+    os.replace(tmpfile.name, path)
+    evict_llm_cache()
+    return content
+
+def llm_cache_hit_rate():
+    with _llm_cache_lock:
+        lookups = llm_cache_stats["hits"] + llm_cache_stats["misses"]
+        return llm_cache_stats["hits"] / lookups if lookups else 0.0
+
+SLACK_MAX_BLOCKS = 50
+SLACK_SECTION_LIMIT = 2900  # Slack rejects section text over 3000 characters
+SLACK_MESSAGE_LIMIT = 40000  # and truncates messages beyond 40k characters
+
+def _pack(parts, separator, limit):
+    """Greedily join parts (each at most limit long) into as few strings of at most limit characters as possible."""
+    packed, current, size = [], [], 0
+    for part in parts:
+        if current and size + len(separator) + len(part) > limit:
+            packed.append(separator.join(current))
+            current, size = [], 0
+        size += len(part) + (len(separator) if current else 0)
+        current.append(part)
+    if current:
+        packed.append(separator.join(current))
+    return packed
+
+def split_text(text, limit=SLACK_SECTION_LIMIT):
+    """Split text into pieces of at most limit characters at paragraph, then line boundaries."""
+    paragraphs = []
+    for paragraph in re.split(r"\n{2,}", text.strip()):
+        if len(paragraph) <= limit:
+            paragraphs.append(paragraph)
+            continue
+        lines = [line[i:i + limit] for line in paragraph.split("\n") for i in range(0, max(len(line), 1), limit)]
+        paragraphs.extend(_pack(lines, "\n", limit))
+    return _pack(paragraphs, "\n\n", limit)
+
+def safe_trim(text, limit=SLACK_SECTION_LIMIT):
+    """Trim text to one section's worth, at a paragraph boundary."""
+    pieces = split_text(text, limit - 50)
+    return pieces[0] + "\n\n_⚠️ Truncated: Digest was too long_" if len(pieces) > 1 else text
+
+def section_block(text):
+    return {"type": "section", "text": {"type": "mrkdwn", "text": text}}
+
+def updated_at_block():
+    return {"type": "context", "elements": [{"type": "mrkdwn", "text": f"_Updated at: {datetime.now().strftime('%I:%M %p')}_"}]}
+
+def pack_blocks(tagged_blocks):
+    """Group (tag, block) pairs, in order, into as few messages as Slack's block and size limits allow.
+
+    Returns (tags, blocks) per message, where tags is the set of tags whose blocks it carries.
+    """
+    messages, size = [], 0
+    for tag, block in tagged_blocks:
+        length = len(json.dumps(block))
+        if not messages or len(messages[-1][1]) >= SLACK_MAX_BLOCKS or size + length > SLACK_MESSAGE_LIMIT:
+            messages.append((set(), []))
+            size = 0
+        messages[-1][0].add(tag)
+        messages[-1][1].append(block)
+        size += length
+    return messages
+
+def render_messages(text, header=None, footer=None):
+    """Render text into as few Slack messages as possible, in one pass.
+
+    header blocks open the first message and footer blocks close the last one. Returns a list of
+    block lists, one per message.
+    """
+    blocks = list(header or []) + [section_block(piece) for piece in split_text(text)] + list(footer or [])
+    return [message for _, message in pack_blocks((None, block) for block in blocks)]
+
+class SlackDelivery:
+    """Per-channel queues of chat.postMessage/chat.update calls, paced per channel and retried on 429."""
+
+    def __init__(self, client, workers=SLACK_DELIVERY_WORKERS):
+        self.client = client
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="slack-delivery")
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.buckets = {}
+
+    def post(self, channel, text, blocks):
+        """Queue one message; returns a Future of the chat.postMessage response."""
+        return self._queue(channel, "chat_postMessage", text=text, blocks=blocks)
+
+    def update(self, channel, ts, text, blocks=None):
+        """Queue an edit of a posted message; returns a Future of the chat.update response."""
+        return self._queue(channel, "chat_update", ts=ts, text=text, blocks=blocks or [])
+
+    def _queue(self, channel, method, **kwargs):
+        future = Future()
+        with self.lock:
+            if channel not in self.pending:
+                self.pending[channel] = deque()
+                self.buckets.setdefault(channel, TokenBucket(SLACK_CHANNEL_RATE_PER_SECOND, SLACK_CHANNEL_BURST))
+                self.pool.submit(self._drain, channel)
+            # Carry the caller's context so the slack.post span lands on the command that queued it
+            self.pending[channel].append((contextvars.copy_context(), method, kwargs, future))
+        return future
+
+    def deliver(self, channel, text, messages):
+        """Post every message in order and wait for them; raises the first failure."""
+        futures = [self.post(channel, text, blocks) for blocks in messages]
+        return [future.result() for future in futures]
+
+    def _drain(self, channel):
+        while True:
+            with self.lock:
+                if not self.pending[channel]:
+                    del self.pending[channel]
+                    return
+                context, method, kwargs, future = self.pending[channel].popleft()
+            try:
+                future.set_result(context.run(self._send, channel, method, kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _send(self, channel, method, kwargs):
+        for attempt in range(SLACK_MAX_RETRIES + 1):
+            self.buckets[channel].acquire()
+            try:
+                with span("slack.post"):
+                    return getattr(self.client, method)(channel=channel, **kwargs)
+            except SlackApiError as e:
+                if e.response.status_code != 429 or attempt == SLACK_MAX_RETRIES:
+                    raise
+                retry_after = next((v for k, v in e.response.headers.items() if k.lower() == "retry-after"), "1")
+                delay = float(retry_after[0] if isinstance(retry_after, list) else retry_after)
+                metrics.inc("slack_retries_total")
+                print(f"⏳ Slack rate-limited posts to {channel}, retrying in {delay:.0f}s")
+                time.sleep(delay)
+
+slack_delivery = SlackDelivery(slack_client)
+
+def search_jira(jql, fields=JIRA_FIELDS):
+    """Run a JQL search, following startAt/total pagination until every issue is fetched."""
     url = f"{JIRA_BASE_URL}/rest/api/3/search"
-    jql = f"assignee = '{user_email}' AND statusCategory != Done ORDER BY priority DESC"
     headers = {
         "Authorization": f"Basic {JIRA_API_TOKEN}",
         "Content-Type": "application/json"
     }
-    params = {
-        "jql": jql,
-        "fields": "summary,status,priority,duedate"
-    }
-    response = requests.get(url, headers=headers, params=params)
-    return response.json().get("issues", [])
-
-@app.command("/priority")
-def classify_priorities(ack, body, say):
-    ack()
-    channel_id = body['channel_id']
-
-    summary_lines = []
-    for user_id in ALLOWED_USERS:
-        email = SLACK_TO_JIRA_EMAIL.get(user_id)
-        if not email:
-            continue
-
-        issues = get_jira_issues(email)
-        for issue in issues:
-            key = issue['key']
-            summary = issue['fields']['summary']
-            status = issue['fields']['status']['name']
-            priority_obj = issue['fields'].get('priority')
-            priority = priority_obj.get('name', '').lower() if priority_obj else ''
-
-            if priority in ["high", "major", "immediate"]:
-                jira_url = f"{JIRA_BASE_URL}/browse/{key}"
-                summary_lines.append(f"*<{jira_url}|{key}>*: {summary} _(Status: {status}, Priority: {priority.title()}, Owner: <@{user_id}>)_")
-
-    if not summary_lines:
-        say(channel=channel_id, text="✅ No critical Jira issues found.")
-        return
-
-    blocks = [
-        {"type": "header", "text": {"type": "plain_text", "text": "🔥 Team-Wide Critical Jira Issues"}},
-        {"type": "divider"}
-    ]
+    issues = []
+    while True:
+        params = {
+            "jql": jql,
+            "fields": fields,
+            "startAt": len(issues),
+            "maxResults": JIRA_PAGE_SIZE
+        }
+        with span("jira.search"):
+            response = http_get(url, headers=headers, params=params)
+        response.raise_for_status()
+        data = response.json()
+        page = data.get("issues", [])
+        issues.extend(page)
+        if not page or len(issues) >= data.get("total", 0):
+            return issues
+
+def search_user_jira_issues(user_email):
+    """One user's open issues, straight from Jira (no index, no cache)."""
+    return search_jira(f"assignee = '{user_email}' AND statusCategory != Done ORDER BY priority DESC")
 
-    for line in summary_lines:
-        blocks.append({
-            "type": "section",
-            "text": {"type": "mrkdwn", "text": f":red_circle: {line}"}
-        })
+def get_jira_issues(user_email):
+    if work_index.ready:
+        return work_index.jira_issues(user_email)
 
-    say(channel=channel_id, text="Critical Jira Issues", blocks=blocks)
+    def fetch():
+        try:
+            return search_user_jira_issues(user_email)
+        except requests.HTTPError as e:
+            print(f"❌ Jira search failed for {user_email}: {e}")
+            return None
+
+    return cached_fetch("jira", ("user", user_email), fetch)
+
+def get_team_jira_issues(emails, priorities=None):
+    """Fetch open issues for all emails with a single JQL search and partition them by assignee.
+
+    Falls back to per-user searches if the batched query is rejected or Jira hides assignee emails.
+    """
+    emails = tuple(dict.fromkeys(e for e in emails if e))
+    priorities = tuple(priorities or ())
+    if work_index.ready:
+        return work_index.team_jira_issues(emails, priorities)
+    return cached_fetch("jira", ("team", emails, priorities), lambda: _search_team_jira_issues(emails, priorities))
+
+def _search_team_jira_issues(emails, priorities, strict=False):
+    """Batched search behind get_team_jira_issues; with strict=True a failed per-user fallback raises.
+
+    Assignees go JIRA_ASSIGNEE_BATCH to a query so the JQL, and the GET URL carrying it, stays bounded.
+    """
+    issues_by_email = {email: [] for email in emails}
+    if not emails:
+        return issues_by_email
+
+    def search_chunk(chunk):
+        assignees = ", ".join(f"'{email}'" for email in chunk)
+        jql = f"assignee in ({assignees}) AND statusCategory != Done"
+        if priorities:
+            jql += " AND priority in (" + ", ".join(f'"{p}"' for p in priorities) + ")"
+        jql += " ORDER BY priority DESC"
+        try:
+            return search_jira(jql, JIRA_FIELDS + ",assignee")
+        except requests.HTTPError as e:
+            print(f"⚠️ Batched Jira search failed, falling back to per-user searches for {len(chunk)} users: {e}")
+            return None
+
+    chunks = [emails[i:i + JIRA_ASSIGNEE_BATCH] for i in range(0, len(emails), JIRA_ASSIGNEE_BATCH)]
+    lookup = {email.lower(): email for email in emails}
+    fallback = []
+    for chunk, issues in zip(chunks, fan_out(search_chunk, chunks)):
+        if issues is None:
+            fallback.extend(chunk)
+        for issue in issues or []:
+            assignee = (issue['fields'].get('assignee') or {}).get('emailAddress')
+            if not assignee:
+                print("⚠️ Jira did not return assignee emails, falling back to per-user searches")
+                fallback = emails
+                break
+            if assignee.lower() in lookup:
+                issues_by_email[lookup[assignee.lower()]].append(issue)
+        if fallback is emails:
+            break
+
+    if fallback:
+        fetch = search_user_jira_issues if strict else lambda email: get_jira_issues(email) or []
+        issues_by_email.update(zip(fallback, fan_out(fetch, fallback)))
+    return issues_by_email
+
+def get_paginated(url, params=None, strict=False, **kwargs):
+    """Follow Bitbucket's `next` links and return the values from every page (strict=True raises on a failed page)."""
+    values = []
+    while url:
+        response = http_get(url, params=params, **kwargs)
+        if response.status_code != 200:
+            if strict:
+                response.raise_for_status()
+            break
+        data = response.json()
+        values.extend(data.get("values", []))
+        url = data.get("next")
+        params = None  # the next link already carries the query string
+    return values
+
+def bitbucket_user_key(user):
+    user = user or {}
+    return user.get("username") or user.get("nickname")
+
+def fetch_repo_open_prs(repo, username=None, strict=False):
+    # Without BITBUCKET_USERNAME or a requesting user, list as any mapped user
+    username = BITBUCKET_USERNAME or username or next(iter(SLACK_TO_BITBUCKET_USERNAME.values()), None)
+    url = f"{BITBUCKET_API_URL}/repositories/{BITBUCKET_WORKSPACE}/{repo}/pullrequests"
+    params = {"q": "state=\"OPEN\"", "pagelen": 50, "fields": "+values.reviewers"}
+    prs = get_paginated(url, params=params, strict=strict, auth=(username, BITBUCKET_APP_PASSWORD))
+    # Sort by created_on descending (newest first)
+    prs.sort(key=lambda pr: pr['created_on'], reverse=True)
+    return prs
+
+def get_pr_index(username=None):
+    """Return open PRs keyed by author and by reviewer, shared by every user until the PR cache expires.
+
+    Returns None (and caches nothing) if any repo could not be listed.
+    """
+    if work_index.ready:
+        return work_index.pr_index()
+
+    def build():
+        by_author, by_reviewer = {}, {}
+        try:
+            with span("bitbucket.pr_index"):
+                repo_prs = fan_out(lambda repo: fetch_repo_open_prs(repo, username, strict=True), BITBUCKET_REPOS)
+        except requests.HTTPError as e:
+            print(f"❌ Failed to list open PRs: {e}")
+            return None
+        for prs in repo_prs:
+            for pr in prs:
+                by_author.setdefault(bitbucket_user_key(pr.get("author")), []).append(pr)
+                for reviewer in pr.get("reviewers", []):
+                    by_reviewer.setdefault(bitbucket_user_key(reviewer), []).append(pr)
+        return {"by_author": by_author, "by_reviewer": by_reviewer}
+
+    return cached_fetch("prs", ("index", tuple(BITBUCKET_REPOS)), build)
+
+def get_unresolved_comment_count(pr, username):
+    """Count a PR's unresolved comments, refetching only when its updated_on or comment_count changes.
+
+    Returns None if the comments could not be fetched.
+    """
+    if pr.get("comment_count") == 0:
+        return 0
+
+    comments_url = pr['links']['comments']['href']
+
+    def fetch():
+        auth = (username, BITBUCKET_APP_PASSWORD)
+        response = http_get(comments_url, params={"pagelen": 100}, auth=auth)
+        if response.status_code != 200:
+            return None
+        first = response.json()
+        pages = [first]
+        if "size" in first and first.get("next"):
+            # Page count is known up front, so fetch the remaining pages concurrently
+            page_count = -(-first["size"] // first.get("pagelen", 100))
+
+            def fetch_page(page):
+                page_resp = http_get(comments_url, params={"pagelen": 100, "page": page}, auth=auth)
+                return page_resp.json() if page_resp.status_code == 200 else None
+
+            pages += fan_out(fetch_page, range(2, page_count + 1))
+            # A missing page would undercount, so leave the result uncached and refetch next time
+            if None in pages:
+                return None
+        else:
+            next_url = first.get("next")
+            while next_url:
+                page_resp = http_get(next_url, auth=auth)
+                if page_resp.status_code != 200:
+                    return None
+                pages.append(page_resp.json())
+                next_url = pages[-1].get("next")
+
+        comments = [c for page in pages for c in page.get("values", [])]
+        return sum(1 for c in comments if not c.get("deleted", False) and not c.get("resolved", True))
+
+    def timed_fetch():
+        with span("bitbucket.comments"):
+            return fetch()
+
+    key = (comments_url, pr.get("updated_on"), pr.get("comment_count"))
+    return cached_fetch("comments", key, timed_fetch)
 
 def get_user_created_prs(username):
-    all_prs = []
-    for repo in BITBUCKET_REPOS:
-        url = f"https://api.bitbucket.org/2.0/repositories/{BITBUCKET_WORKSPACE}/{repo}/pullrequests"
-        params = {"q": f"author.username=\"{username}\" AND state=\"OPEN\""}
-        response = requests.get(url, auth=(username, BITBUCKET_APP_PASSWORD), params=params)
-        if response.status_code == 200:
-            prs = response.json().get("values", [])
+    if work_index.ready:
+        return _fetch_user_created_prs(username)
+    return cached_fetch("prs", ("author", username), lambda: _fetch_user_created_prs(username))
+
+def _fetch_user_created_prs(username):
+    """The user's open PRs with unresolved comment counts, or None if a listing or a count failed."""
+    def fetch_unresolved(pr):
+        pr = dict(pr)
+        pr['unresolved_comments'] = get_unresolved_comment_count(pr, username)
+        return pr
+
+    if BITBUCKET_PR_INDEX or work_index.ready:
+        index = get_pr_index(username)
+        prs = None if index is None else fan_out(fetch_unresolved, index["by_author"].get(username, []))
+    else:
+        def fetch_repo(repo):
+            url = f"{BITBUCKET_API_URL}/repositories/{BITBUCKET_WORKSPACE}/{repo}/pullrequests"
+            params = {"q": f"author.username=\"{username}\" AND state=\"OPEN\"", "pagelen": 50}
+            prs = get_paginated(url, params=params, strict=True, auth=(username, BITBUCKET_APP_PASSWORD))
             # Sort by created_on descending (newest first)
             prs.sort(key=lambda pr: pr['created_on'], reverse=True)
-            for pr in prs:
-                # Fetch unresolved comments
-                comments_url = pr['links']['comments']['href']
-                comment_resp = requests.get(comments_url, auth=(username, BITBUCKET_APP_PASSWORD))
-                unresolved_count = 0
-                if comment_resp.status_code == 200:
-                    comments = comment_resp.json().get("values", [])
-                    unresolved_count = sum(1 for c in comments if not c.get("deleted", False) and not c.get("resolved", True))
-                pr['unresolved_comments'] = unresolved_count
-                all_prs.append(pr)
-    return all_prs
+            # Fetch unresolved comments
+            return fan_out(fetch_unresolved, prs)
+
+        try:
+            prs = [pr for prs in fan_out(fetch_repo, BITBUCKET_REPOS) for pr in prs]
+        except requests.HTTPError as e:
+            print(f"❌ Failed to list PRs authored by {username}: {e}")
+            return None
+
+    if prs is None or any(pr['unresolved_comments'] is None for pr in prs):
+        return None
+    return prs
 
 
 def get_user_review_prs(username):
-    all_prs = []
-    for repo in BITBUCKET_REPOS:
-        url = f"https://api.bitbucket.org/2.0/repositories/{BITBUCKET_WORKSPACE}/{repo}/pullrequests"
-        params = {"q": f"reviewers.username=\"{username}\" AND state=\"OPEN\""}
-        response = requests.get(url, auth=(username, BITBUCKET_APP_PASSWORD), params=params)
-        if response.status_code == 200:
-            all_prs.extend(response.json().get("values", []))
-    return all_prs
-
-def generate_digest(jira_issues, user_prs, review_prs, slack_user_id=None):
-    if not jira_issues and not user_prs and not review_prs:
-        return f"*✅ No Jira tickets or PRs for <@{slack_user_id}> today. 🎉*"
+    if work_index.ready:
+        return _fetch_user_review_prs(username)
+    return cached_fetch("prs", ("reviewer", username), lambda: _fetch_user_review_prs(username))
 
-    user_label = f"<@{slack_user_id}>" if slack_user_id else "You"
+def _fetch_user_review_prs(username):
+    """The open PRs the user reviews, or None if a listing failed."""
+    if BITBUCKET_PR_INDEX or work_index.ready:
+        index = get_pr_index(username)
+        return None if index is None else list(index["by_reviewer"].get(username, []))
+
+    def fetch_repo(repo):
+        url = f"{BITBUCKET_API_URL}/repositories/{BITBUCKET_WORKSPACE}/{repo}/pullrequests"
+        params = {"q": f"reviewers.username=\"{username}\" AND state=\"OPEN\"", "pagelen": 50}
+        return get_paginated(url, params=params, strict=True, auth=(username, BITBUCKET_APP_PASSWORD))
+
+    try:
+        return [pr for prs in fan_out(fetch_repo, BITBUCKET_REPOS) for pr in prs]
+    except requests.HTTPError as e:
+        print(f"❌ Failed to list PRs reviewed by {username}: {e}")
+        return None
 
-    jira_summary = ""
+def slim_issue(issue):
+    """Keep only the issue fields a Jira search would have returned."""
+    fields = issue.get("fields") or {}
+    return {"key": issue["key"], "fields": {name: fields.get(name) for name in (JIRA_FIELDS + ",assignee").split(",")}}
+
+def issue_assignee(issue):
+    return ((issue["fields"].get("assignee") or {}).get("emailAddress") or "").lower()
+
+class WorkIndex:
+    """In-memory open Jira issues and Bitbucket PRs, fed by webhooks and periodically reconciled with the APIs."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.issues_by_email = {}  # lowercase assignee email -> {issue key: issue}
+        self.issue_owner = {}  # issue key -> lowercase assignee email
+        self.prs = {}  # (repo slug, PR id) -> PR
+        self.touched_issues, self.touched_prs = set(), set()  # changed by webhooks during a reconcile
+        self.ready = False
+
+    def _put_issue(self, key, issue, owner=None):
+        """Replace (or with issue=None, drop) one issue. Caller holds the lock."""
+        old_owner = self.issue_owner.pop(key, None)
+        if old_owner is not None:
+            self.issues_by_email.get(old_owner, {}).pop(key, None)
+        if issue is not None:
+            owner = owner or issue_assignee(issue)
+            self.issue_owner[key] = owner
+            self.issues_by_email.setdefault(owner, {})[key] = issue
+
+    def apply_jira_event(self, payload):
+        issue = payload.get("issue") or {}
+        if not issue.get("key"):
+            return False
+        status = (issue.get("fields") or {}).get("status") or {}
+        closed = payload.get("webhookEvent") == "jira:issue_deleted" or (status.get("statusCategory") or {}).get("key") == "done"
+        with self.lock:
+            self.touched_issues.add(issue["key"])
+            self._put_issue(issue["key"], None if closed else slim_issue(issue))
+        return True
+
+    def apply_bitbucket_event(self, payload):
+        pr = payload.get("pullrequest") or {}
+        repo = ((payload.get("repository") or {}).get("full_name") or "").split("/")[-1]
+        if not pr.get("id") or repo not in BITBUCKET_REPOS:
+            return False
+        with self.lock:
+            self.touched_prs.add((repo, pr["id"]))
+            if pr.get("state") == "OPEN":
+                self.prs[(repo, pr["id"])] = pr
+            else:
+                self.prs.pop((repo, pr["id"]), None)
+        return True
+
+    def jira_issues(self, email):
+        with self.lock:
+            issues = list(self.issues_by_email.get((email or "").lower(), {}).values())
+        # Same order as the JQL searches' ORDER BY priority DESC
+        return sorted(issues, key=lambda i: -PRIORITY_SCORES.get((i["fields"].get("priority") or {}).get("name"), 15))
+
+    def team_jira_issues(self, emails, priorities=()):
+        wanted = {p.lower() for p in priorities}
+        return {
+            email: [i for i in self.jira_issues(email)
+                    if not wanted or ((i["fields"].get("priority") or {}).get("name") or "").lower() in wanted]
+            for email in emails
+        }
+
+    def pr_index(self):
+        with self.lock:
+            prs = sorted(self.prs.values(), key=lambda pr: pr["created_on"], reverse=True)
+        by_author, by_reviewer = {}, {}
+        for pr in prs:
+            by_author.setdefault(bitbucket_user_key(pr.get("author")), []).append(pr)
+            for reviewer in pr.get("reviewers", []):
+                by_reviewer.setdefault(bitbucket_user_key(reviewer), []).append(pr)
+        return {"by_author": by_author, "by_reviewer": by_reviewer}
+
+    def reconcile(self):
+        """Reload every mapped user's open issues and every open PR from the APIs; raises if any listing fails."""
+        with self.lock:
+            self.touched_issues, self.touched_prs = set(), set()
+        emails = set(SLACK_TO_JIRA_EMAIL.values()) | {p["jira_email"] for p in USER_PREFERENCES.values() if p.get("jira_email")}
+        # Bypass the index and the cache, or a reconcile would just read back what it already holds
+        issues_by_email = _search_team_jira_issues(tuple(sorted(emails)), (), strict=True)
+        repo_prs = fan_out(lambda repo: fetch_repo_open_prs(repo, strict=True), BITBUCKET_REPOS)
+
+        with self.lock:
+            # Webhook versions (including removals) win over the possibly older API snapshot
+            kept_issues = {key: (self.issue_owner[key], self.issues_by_email[self.issue_owner[key]][key])
+                           for key in self.touched_issues if key in self.issue_owner}
+            self.issues_by_email, self.issue_owner = {}, {}
+            for email, issues in issues_by_email.items():
+                for issue in issues:
+                    if issue["key"] not in self.touched_issues:
+                        self._put_issue(issue["key"], slim_issue(issue), email.lower())
+            for key, (owner, issue) in kept_issues.items():
+                self._put_issue(key, issue, owner)
+
+            kept_prs = {key: self.prs[key] for key in self.touched_prs if key in self.prs}
+            self.prs = {(repo, pr["id"]): pr for repo, prs in zip(BITBUCKET_REPOS, repo_prs) for pr in prs
+                        if (repo, pr["id"]) not in self.touched_prs}
+            self.prs.update(kept_prs)
+            self.ready = True
+            print(f"🔄 Work index reconciled: {len(self.issue_owner)} issues, {len(self.prs)} PRs")
+
+    def run(self):
+        while True:
+            try:
+                self.reconcile()
+            except Exception as e:
+                print(f"❌ Work index reconciliation failed: {e}")
+            time.sleep(WORK_INDEX_RECONCILE_MINUTES * 60)
+
+work_index = WorkIndex()
+
+@metrics.collector
+def work_index_gauges():
+    with work_index.lock:
+        yield "work_index_ready", {}, int(work_index.ready)
+        yield "work_index_issues", {}, len(work_index.issue_owner)
+        yield "work_index_prs", {}, len(work_index.prs)
+
+_webhook_record_lock = threading.Lock()
+
+def webhook_signature(body, secret=None):
+    return "sha256=" + hmac.new((secret or WEBHOOK_SECRET).encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    """Accepts POST /webhooks/jira and /webhooks/bitbucket signed with X-Hub-Signature (HMAC-SHA256)."""
+
+    def do_POST(self):
+        source = {"/webhooks/jira": "jira", "/webhooks/bitbucket": "bitbucket"}.get(self.path.split("?")[0])
+        if source is None:
+            self.send_error(404)
+            return
+        # The body is unauthenticated until its signature is checked, so bound it before reading it
+        length = self.headers.get("Content-Length") or "0"
+        if not length.isdigit() or int(length) > WEBHOOK_MAX_BYTES:
+            metrics.inc("webhook_events_total", source=source, status="rejected")
+            self.close_connection = True
+            self.send_error(400 if not length.isdigit() else 413)
+            return
+        body = self.rfile.read(int(length))
+        if not hmac.compare_digest(self.headers.get("X-Hub-Signature", ""), webhook_signature(body)):
+            metrics.inc("webhook_events_total", source=source, status="rejected")
+            self.send_error(401)
+            return
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            metrics.inc("webhook_events_total", source=source, status="rejected")
+            self.send_error(400)
+            return
+
+        if WEBHOOK_RECORD_PATH:
+            with _webhook_record_lock, open(WEBHOOK_RECORD_PATH, "a") as f:
+                f.write(json.dumps({"path": self.path, "event_key": self.headers.get("X-Event-Key"), "body": body.decode("utf-8")}) + "\n")
+        applied = work_index.apply_jira_event(payload) if source == "jira" else work_index.apply_bitbucket_event(payload)
+        metrics.inc("webhook_events_total", source=source, status="applied" if applied else "ignored")
+        team_workers.forward_webhook(source, payload)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def start_webhook_server():
+    """Start the webhook receiver and the reconciliation loop; reads poll the APIs until the first reconcile."""
+    if not WEBHOOK_PORT:
+        return None
+    if not WEBHOOK_SECRET:
+        print("⚠️ WEBHOOK_PORT is set but WEBHOOK_SECRET is not; webhook receiver disabled")
+        return None
+    server = ThreadingHTTPServer((WEBHOOK_HOST, WEBHOOK_PORT), _WebhookHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="webhook-server", daemon=True).start()
+    threading.Thread(target=work_index.run, name="work-index", daemon=True).start()
+    print(f"🪝 Receiving webhooks on http://{WEBHOOK_HOST}:{WEBHOOK_PORT}/webhooks/{{jira,bitbucket}}")
+    return server
+
+def build_digest_sections(jira_issues, user_prs, review_prs):
+    """Render the deterministic Jira, authored-PR and review-PR lists of a digest."""
+    jira_lines, user_pr_lines, review_pr_lines = [], [], []
     for i in jira_issues:
         key = i['key']
         summary = i['fields']['summary']
@@ -188,9 +1574,8 @@ def generate_digest(jira_issues, user_prs, review_prs, slack_user_id=None):
         }.get(priority_raw, "⚪")
         priority = f"{priority_emoji} {priority_raw}"
         jira_link = f"{JIRA_BASE_URL}/browse/{key}"
-        jira_summary += f"• *<{jira_link}|{key}>*: {summary} _({status}, Priority: {priority})_\n\n"
+        jira_lines.append(f"• *<{jira_link}|{key}>*: {summary} _({status}, Priority: {priority})_\n\n")
 
-    user_pr_summary = ""
     for pr in user_prs:
         title = pr['title']
         pr_id = pr['id']
@@ -198,392 +1583,1126 @@ def generate_digest(jira_issues, user_prs, review_prs, slack_user_id=None):
         reviewers = ", ".join([r['display_name'] for r in pr.get("reviewers", [])])
         unresolved = pr.get('unresolved_comments', 0)
         comment_info = f"{unresolved} unresolved comment(s)" if unresolved > 0 else "No unresolved comments"
-        user_pr_summary += f"• *<{pr_link}|PR #{pr_id}>*: {title} _(Reviewers: {reviewers}, {comment_info})_\n\n"
+        user_pr_lines.append(f"• *<{pr_link}|PR #{pr_id}>*: {title} _(Reviewers: {reviewers}, {comment_info})_\n\n")
 
-    review_pr_summary = ""
     for pr in review_prs:
         title = pr['title']
         author = pr['author']['display_name']
         pr_id = pr['id']
         pr_link = pr['links']['html']['href']
-        review_pr_summary += f"• *<{pr_link}|PR #{pr_id}>*: {title} _(by {author})_\n\n"
+        review_pr_lines.append(f"• *<{pr_link}|PR #{pr_id}>*: {title} _(by {author})_\n\n")
 
-    prompt = f"""
-You are a task management assistant. From the following list of *open or in-progress* Jira issues and Bitbucket PRs, return the top 3 tasks for today, ranked by urgency or importance.
+    return "".join(jira_lines), "".join(user_pr_lines), "".join(review_pr_lines)
 
-Jira Tasks:
-{jira_summary}
+PRIORITY_SCORES = {"Highest": 50, "Immediate": 50, "Critical": 50, "High": 40, "Major": 40, "Medium": 25, "Low": 10, "Minor": 10, "Lowest": 5}
 
-PRs:
-{user_pr_summary + review_pr_summary}
+def days_since(ts, now):
+    try:
+        return max(0, (now - parse_bitbucket_ts(ts)).days)
+    except (TypeError, ValueError):
+        return 0
+
+def score_candidates(jira_issues, user_prs, review_prs, now=None):
+    """Score every issue and PR from fields we already have, most urgent first.
+
+    Returns (score, link, label, title, line) tuples; line is the compact encoding sent to the LLM.
+    Jira issues score on priority and due date; authored PRs on age and unresolved comments;
+    review requests on age, since the author is blocked on them.
+    """
+    now = now or datetime.now(timezone.utc)
+    candidates = []
+    for issue in jira_issues:
+        fields = issue['fields']
+        priority = (fields.get('priority') or {}).get('name') or "None"
+        status = fields['status']['name']
+        score = PRIORITY_SCORES.get(priority, 15) + (5 if status.lower() == "in progress" else 0)
+        due_text = ""
+        if fields.get('duedate'):
+            try:
+                days_left = (datetime.strptime(fields['duedate'], "%Y-%m-%d").date() - now.date()).days
+                score += 40 if days_left < 0 else max(0, 30 - 5 * days_left)
+                due_text = "|overdue" if days_left < 0 else f"|due in {days_left}d"
+            except ValueError:
+                pass
+        line = f"{issue['key']}|{priority}|{status}{due_text}|{fields['summary'][:80]}"
+        candidates.append((score, f"{JIRA_BASE_URL}/browse/{issue['key']}", issue['key'], fields['summary'], line))
+
+    for pr in user_prs:
+        age = days_since(pr.get('created_on'), now)
+        unresolved = pr.get('unresolved_comments', 0)
+        score = 10 + min(age, 14) * 2 + unresolved * 8
+        line = f"PR#{pr['id']}|mine|{age}d old|{unresolved} unresolved|{pr['title'][:80]}"
+        candidates.append((score, pr['links']['html']['href'], f"PR #{pr['id']}", pr['title'], line))
+
+    for pr in review_prs:
+        age = days_since(pr.get('created_on'), now)
+        score = 20 + min(age, 14) * 3
+        line = f"PR#{pr['id']}|review for {pr['author']['display_name']}|{age}d old|{pr['title'][:80]}"
+        candidates.append((score, pr['links']['html']['href'], f"PR #{pr['id']}", pr['title'], line))
+
+    candidates.sort(key=lambda c: -c[0])
+    return candidates
+
+def select_candidates(candidates, top_k=DIGEST_TOP_K, token_budget=DIGEST_PROMPT_TOKEN_BUDGET):
+    """Take the best candidates' lines, up to top_k and roughly token_budget tokens (~4 chars each)."""
+    lines, used = [], 0
+    for candidate in candidates[:top_k]:
+        line = candidate[-1]
+        cost = len(line) // 4 + 1
+        if lines and used + cost > token_budget:
+            break
+        lines.append(line)
+        used += cost
+    return lines
+
+def digest_prompt(candidate_lines):
+    candidates = "\n".join(candidate_lines)
+    return f"""
+You are a task management assistant. Below are a user's most urgent *open or in-progress* Jira issues and Bitbucket PRs, already pre-ranked by priority, due date and age, one per line as ID|details|title. Return the top 3 tasks for today, ranked by urgency or importance, with one short reason each.
+
+{candidates}
 """
-    response = ollama.chat(model='llama3', messages=[{"role": "user", "content": prompt}])
-    ranked_tasks = response['message']['content']
 
-    summary = f"*🔥 Top 3 Priorities for {user_label}:*\n{ranked_tasks}\n\n" \
-              f"*📝 Jira Issues (Open/In Progress):*\n{jira_summary or '_None_'}\n\n" \
-              f"*📦 Open PRs by {user_label}:*\n{user_pr_summary or '_None_'}\n\n" \
-              f"*👀 PRs Awaiting Review by {user_label}:*\n{review_pr_summary or '_None_'}\n\n" \
-              f"👉 Click on the issue IDs above to open them directly in Jira or Bitbucket."
+def render_scored_top3(candidates):
+    """Fallback Top 3 straight from the local scores, used when Ollama is slow or down."""
+    lines = [f"{n}. *<{link}|{label}>*: {title}" for n, (_, link, label, title, _) in enumerate(candidates[:3], 1)]
+    return "\n".join(lines) + "\n_(Ranked by priority, due date and age; AI ranking unavailable.)_"
+
+def rank_top3(jira_issues, user_prs, review_prs, on_update=None):
+    """Return the Top 3: the LLM's pick among the top-K scored candidates, or the scored list on failure."""
+    with span("digest.score"):
+        candidates = score_candidates(jira_issues, user_prs, review_prs)
+        lines = select_candidates(candidates)
+    try:
+        return cached_llm_chat(digest_prompt(lines), "digest", ["\n".join(lines)], on_update=on_update)
+    except Exception as e:
+        print(f"⚠️ LLM ranking failed, using the scored list: {e}")
+        metrics.inc("llm_fallbacks_total", kind="digest")
+        return render_scored_top3(candidates)
+
+def render_digest_lists(user_label, jira_summary, user_pr_summary, review_pr_summary):
+    return f"*📝 Jira Issues (Open/In Progress):*\n{jira_summary or '_None_'}\n\n" \
+           f"*📦 Open PRs by {user_label}:*\n{user_pr_summary or '_None_'}\n\n" \
+           f"*👀 PRs Awaiting Review by {user_label}:*\n{review_pr_summary or '_None_'}\n\n" \
+           f"👉 Click on the issue IDs above to open them directly in Jira or Bitbucket."
+
+def generate_digest(jira_issues, user_prs, review_prs, slack_user_id=None, use_llm=True):
+    """Render a user's digest; with use_llm=False only the lists are rendered, without the Top 3."""
+    if not jira_issues and not user_prs and not review_prs:
+        return f"*✅ No Jira tickets or PRs for <@{slack_user_id}> today. 🎉*"
+
+    user_label = f"<@{slack_user_id}>" if slack_user_id else "You"
+
+    with span("digest.render"):
+        sections = build_digest_sections(jira_issues, user_prs, review_prs)
+    if not use_llm:
+        return render_digest_lists(user_label, *sections)
+    ranked_tasks = rank_top3(jira_issues, user_prs, review_prs)
+
+    summary = f"*🔥 Top 3 Priorities for {user_label}:*\n{ranked_tasks}\n\n" + render_digest_lists(user_label, *sections)
 
     return summary
 
+PARTIAL_DIGEST_NOTE = "_⚠️ Jira or Bitbucket couldn't be reached, so some items may be missing below._"
+
+def digest_snapshot(jira_issues, user_prs, review_prs):
+    """Compact record of what a digest showed, compared against by the next delta digest."""
+    return {
+        "issues": {
+            i['key']: {
+                "summary": i['fields']['summary'],
+                "status": i['fields']['status']['name'],
+                "priority": (i['fields'].get('priority') or {}).get('name') or "None",
+            }
+            for i in jira_issues
+        },
+        "authored": {
+            pr['links']['html']['href']: {"id": pr['id'], "title": pr['title'], "unresolved": pr.get('unresolved_comments', 0)}
+            for pr in user_prs
+        },
+        "reviews": {
+            pr['links']['html']['href']: {"id": pr['id'], "title": pr['title'], "author": pr['author']['display_name']}
+            for pr in review_prs
+        },
+    }
+
+def load_digest_snapshot(user_id):
+    """Return (snapshot, delivered_at) of the user's last delivered digest, or (None, None)."""
+    db = activity_db()
+    with _activity_db_lock:
+        row = db.execute("SELECT snapshot, delivered_at FROM digest_snapshots WHERE user_id = ?", (user_id,)).fetchone()
+    return (json.loads(row[0]), row[1]) if row else (None, None)
+
+def save_digest_snapshot(user_id, snapshot):
+    db = activity_db()
+    with _activity_db_lock, db:
+        db.execute("INSERT OR REPLACE INTO digest_snapshots VALUES (?, ?, ?)", (user_id, json.dumps(snapshot), time.time()))
+
+def user_digest_mode(user_id, body=None):
+    """`/myday full|delta` wins over the user's digest_mode preference, which wins over DIGEST_MODE."""
+    words = set((body or {}).get("text", "").lower().split())
+    for mode in ("delta", "full"):
+        if mode in words:
+            return mode
+    return USER_PREFERENCES.get(user_id, {}).get("digest_mode") or DIGEST_MODE
+
+def digest_changes(previous, current):
+    """Compare two digest snapshots into lists of (id, details) per kind of change."""
+    changes = {"new": [], "closed": [], "status": [], "priority": [], "reviews": [], "comments": []}
+    for key, issue in current["issues"].items():
+        old = previous["issues"].get(key)
+        if old is None:
+            changes["new"].append(key)
+            continue
+        if old["status"] != issue["status"]:
+            changes["status"].append((key, old["status"], issue["status"]))
+        if old["priority"] != issue["priority"]:
+            changes["priority"].append((key, old["priority"], issue["priority"]))
+    changes["closed"] = [(key, issue["summary"]) for key, issue in previous["issues"].items() if key not in current["issues"]]
+    changes["reviews"] = [link for link in current["reviews"] if link not in previous["reviews"]]
+    for link, pr in current["authored"].items():
+        before = previous["authored"].get(link, {}).get("unresolved", 0)
+        if pr["unresolved"] > before:
+            changes["comments"].append((link, before, pr["unresolved"]))
+    return changes
+
+def generate_delta_digest(jira_issues, user_prs, review_prs, previous, delivered_at, slack_user_id=None):
+    """Render only what changed since the previous snapshot; only changed items go to the LLM ranking."""
+    user_label = f"<@{slack_user_id}>" if slack_user_id else "You"
+    current = digest_snapshot(jira_issues, user_prs, review_prs)
+    changes = digest_changes(previous, current)
+    since = datetime.fromtimestamp(delivered_at).strftime('%a %I:%M %p')
+    if not any(changes.values()):
+        return f"*✅ No changes for {user_label} since the last digest ({since}).*"
+
+    issues = current["issues"]
+
+    def jira_link(key):
+        return f"*<{JIRA_BASE_URL}/browse/{key}|{key}>*"
+
+    def pr_link(link, pr):
+        return f"*<{link}|PR #{pr['id']}>*"
+
+    sections = [
+        ("🆕 New Jira issues", [f"• {jira_link(k)}: {issues[k]['summary']} _({issues[k]['status']}, Priority: {issues[k]['priority']})_" for k in changes["new"]]),
+        ("✅ Closed Jira issues", [f"• {jira_link(k)}: {summary}" for k, summary in changes["closed"]]),
+        ("🔀 Status changes", [f"• {jira_link(k)}: {old} → {new}" for k, old, new in changes["status"]]),
+        ("⚠️ Priority changes", [f"• {jira_link(k)}: {old} → {new}" for k, old, new in changes["priority"]]),
+        ("👀 New review requests", [f"• {pr_link(l, current['reviews'][l])}: {current['reviews'][l]['title']} _(by {current['reviews'][l]['author']})_" for l in changes["reviews"]]),
+        ("💬 New unresolved comments", [f"• {pr_link(l, current['authored'][l])}: {current['authored'][l]['title']} _({old} → {new} unresolved)_" for l, old, new in changes["comments"]]),
+    ]
+    lists = "\n\n".join(f"*{title}:*\n" + "\n".join(lines) for title, lines in sections if lines)
+
+    changed_keys = set(changes["new"]) | {k for k, _, _ in changes["status"] + changes["priority"]}
+    changed_links = set(changes["reviews"]) | {l for l, _, _ in changes["comments"]}
+    ranked_tasks = rank_top3(
+        [i for i in jira_issues if i['key'] in changed_keys],
+        [pr for pr in user_prs if pr['links']['html']['href'] in changed_links],
+        [pr for pr in review_prs if pr['links']['html']['href'] in changed_links],
+    ) if changed_keys or changed_links else "_Nothing new to rank._"
+
+    return f"*🔥 Top 3 Changes for {user_label}:*\n{ranked_tasks}\n\n*🔄 What changed since {since}:*\n\n{lists}"
+
+def stream_daily_digest(user_id, jira_issues, user_prs, review_prs):
+    """Post the digest lists immediately, then stream the LLM's Top 3 into a placeholder message.
+
+    The caller posts the digest header first.
+    """
+    sections = build_digest_sections(jira_issues, user_prs, review_prs)
+    top3_title = "*🔥 Top 3 Priorities for You:*"
+
+    def top3_blocks(text):
+        return [section_block(safe_trim(f"{top3_title}\n{text}"))]
+
+    placeholder = slack_delivery.post(user_id, top3_title, top3_blocks("_⏳ Ranking your work…_")).result()
+    lists = [
+        slack_delivery.post(user_id, "Daily Digest", blocks)
+        for blocks in render_messages(render_digest_lists("You", *sections), footer=[updated_at_block()])
+    ]
+
+    def update_top3(text):
+        slack_delivery.update(placeholder["channel"], placeholder["ts"], top3_title, top3_blocks(text)).result()
+
+    update_top3(rank_top3(jira_issues, user_prs, review_prs, on_update=update_top3))
+    for future in lists:
+        future.result()
 
 @app.command("/myday")
-def daily_digest(ack, body, say):
+def daily_digest(ack, body, say, client):
     ack()
+    if wants_refresh(body):
+        upstream_cache.invalidate()
     user_id = body['user_id']
     jira_email = SLACK_TO_JIRA_EMAIL.get(user_id)
     bitbucket_username = SLACK_TO_BITBUCKET_USERNAME.get(user_id)
-
-    jira_issues = get_jira_issues(jira_email)
-    user_prs = get_user_created_prs(bitbucket_username)
-    review_prs = get_user_review_prs(bitbucket_username)
-    full_summary = generate_digest(jira_issues, user_prs, review_prs)
-
-    MAX_CHUNK = 2800
-    chunks = []
-    while full_summary:
-        chunk = full_summary[:MAX_CHUNK]
-        cutoff = chunk.rfind("\n\n")
-        if cutoff == -1 or len(full_summary) <= MAX_CHUNK:
-            cutoff = len(chunk)
-        chunk = full_summary[:cutoff]
-        chunks.append(chunk)
-        full_summary = full_summary[cutoff:].lstrip()
-
-    say(
-        channel=user_id,
-        text="*🎯 Your Daily Digest*",
-        blocks=[
-            {"type": "section", "text": {"type": "mrkdwn", "text": "*🎯 Your Daily Digest*"}},
+    mode = user_digest_mode(user_id, body)
+
+    def job(update):
+        work = fetch_user_work(jira_email, bitbucket_username)
+        complete = None not in work
+        jira_issues, user_prs, review_prs = (items or [] for items in work)
+        # A delta or snapshot built from a failed fetch would report everything as closed, then as new
+        previous, delivered_at = load_digest_snapshot(user_id) if mode == "delta" and complete else (None, None)
+        # The working message becomes the digest header
+        header = "*🎯 Your Daily Digest*" if complete else f"*🎯 Your Daily Digest*\n{PARTIAL_DIGEST_NOTE}"
+        update("*🎯 Your Daily Digest*", [
+            {"type": "section", "text": {"type": "mrkdwn", "text": header}},
             {"type": "divider"},
-        ]
-    )
-
-    for chunk in chunks:
-        say(
-            channel=user_id,
-            text=chunk,
-            blocks=[
-                {"type": "section", "text": {"type": "mrkdwn", "text": chunk}},
-            ]
-        )
-
-    say(
-        channel=user_id,
-        blocks=[
-            {"type": "context", "elements": [{"type": "mrkdwn", "text": f"_Updated at: {datetime.now().strftime('%I:%M %p')}_"}]}
-        ]
-    )
+        ])
 
-
-def send_scheduled_digests():
-    print("🔁 Running scheduled digest...")
-    for user_id in ALLOWED_USERS:
+        if previous is None and DIGEST_STREAMING and (jira_issues or user_prs or review_prs):
+            stream_daily_digest(user_id, jira_issues, user_prs, review_prs)
+        else:
+            if previous is not None:
+                full_summary = generate_delta_digest(jira_issues, user_prs, review_prs, previous, delivered_at)
+            else:
+                full_summary = generate_digest(jira_issues, user_prs, review_prs)
+            slack_delivery.deliver(user_id, "Daily Digest", render_messages(full_summary, footer=[updated_at_block()]))
+        if complete:
+            save_digest_snapshot(user_id, digest_snapshot(jira_issues, user_prs, review_prs))
+
+    # Only identical requests coalesce: a delta run must not answer a full one
+    submit_command_job(client, body, ("/myday", user_id, mode), "/myday", "⏳ Building your daily digest…", job, channel=user_id)
+
+
+def build_user_digest(user_id, jira_issues=None):
+    """Render a user's scheduled digest; returns (text, snapshot to save once it is delivered).
+
+    The snapshot is None when a source failed, and the digest is then a full one flagged as partial.
+    """
+    prefs = USER_PREFERENCES.get(user_id, {})
+    jira_email = user_jira_email(user_id) or SLACK_TO_JIRA_EMAIL[user_id]
+    bitbucket_username = prefs.get("bitbucket_username") or SLACK_TO_BITBUCKET_USERNAME[user_id]
+    work = fetch_user_work(jira_email, bitbucket_username, jira_issues)
+    jira_issues, user_prs, review_prs = (items or [] for items in work)
+    if None in work:
+        return f"{PARTIAL_DIGEST_NOTE}\n\n{generate_digest(jira_issues, user_prs, review_prs)}", None
+    snapshot = digest_snapshot(jira_issues, user_prs, review_prs)
+    if user_digest_mode(user_id) == "delta":
+        previous, delivered_at = load_digest_snapshot(user_id)
+        if previous is not None:
+            return generate_delta_digest(jira_issues, user_prs, review_prs, previous, delivered_at, user_id), snapshot
+    return generate_digest(jira_issues, user_prs, review_prs), snapshot
+
+def user_jira_email(user_id):
+    return USER_PREFERENCES.get(user_id, {}).get("jira_email") or SLACK_TO_JIRA_EMAIL.get(user_id)
+
+def slot_jira_issues(user_ids):
+    """Issues of a digest slot's users by email from one batched search, or {} if it failed."""
+    emails = tuple(dict.fromkeys(e for e in map(user_jira_email, user_ids) if e))
+    try:
+        with span("digest.slot_search"):
+            return work_index.team_jira_issues(emails, ()) if work_index.ready else _search_team_jira_issues(emails, (), strict=True)
+    except requests.RequestException as e:
+        print(f"⚠️ Batched Jira search for a digest slot failed, users will search their own: {e}")
+        return {}
+
+def scheduled_digest_blocks(user_id, full_summary):
+    header = [section_block(f"*🎯 Daily Digest for <@{user_id}>*"), {"type": "divider"}]
+    return header + [section_block(piece) for piece in split_text(full_summary)]
+
+def post_scheduled_digests(channel, digests):
+    """Pack (user_id, text, snapshot) digests, in order, into as few messages as possible and post them.
+
+    Saves the snapshots of the users whose messages went out and returns their IDs.
+    """
+    tagged_blocks = [(user_id, block) for user_id, full_summary, _ in digests for block in scheduled_digest_blocks(user_id, full_summary)]
+    tagged_blocks.append((None, updated_at_block()))
+    messages = [(users, slack_delivery.post(channel, "Daily Digest", blocks)) for users, blocks in pack_blocks(tagged_blocks)]
+    failed = set()
+    for users, future in messages:
         try:
-            jira_email = SLACK_TO_JIRA_EMAIL[user_id]
-            bitbucket_username = SLACK_TO_BITBUCKET_USERNAME[user_id]
-
-            jira_issues = get_jira_issues(jira_email)
-            user_prs = get_user_created_prs(bitbucket_username)
-            review_prs = get_user_review_prs(bitbucket_username)
-            full_summary = generate_digest(jira_issues, user_prs, review_prs)
-
-            trimmed_summary = safe_trim(full_summary)
-
-            slack_client.chat_postMessage(
-                channel=DIGEST_CHANNEL_ID,
-                text="Daily Digest",
-                blocks=[
-                    {"type": "section", "text": {"type": "mrkdwn", "text": "*🎯 Your Daily Digest*"}},
-                    {"type": "divider"},
-                    {"type": "section", "text": {"type": "mrkdwn", "text": trimmed_summary}},
-                    {"type": "context", "elements": [{"type": "mrkdwn", "text": f"_Updated at: {datetime.now().strftime('%I:%M %p')}_"}]}
-                ]
-            )
+            future.result()
+        except Exception as e:
+            failed |= users
+            print(f"❌ Failed to send digests for {', '.join(u for u in users if u)}: {e}")
+    sent = []
+    for user_id, _, snapshot in digests:
+        if user_id not in failed:
+            if snapshot is not None:
+                save_digest_snapshot(user_id, snapshot)
+            sent.append(user_id)
+    return sent
+
+def digest_channel(user_id):
+    team = TEAM_OF.get(user_id)
+    return team.digest_channel if team else DIGEST_CHANNEL_ID
+
+def user_digest_time(user_id):
+    """Return (hour, minute) of a user's digest slot from user_preferences.json, e.g. "9:30", else their team's."""
+    team = TEAM_OF.get(user_id)
+    value = USER_PREFERENCES.get(user_id, {}).get("digest_time") or (team.digest_time if team else DEFAULT_DIGEST_TIME)
+    try:
+        hour, minute = (int(part) for part in value.strip().split(":"))
+        if 0 <= hour < 24 and 0 <= minute < 60:
+            return hour, minute
+    except ValueError:
+        pass
+    print(f"⚠️ Invalid digest_time {value!r} for {user_id}, using {DEFAULT_DIGEST_TIME}")
+    hour, minute = DEFAULT_DIGEST_TIME.split(":")
+    return int(hour), int(minute)
+
+class DigestScheduler:
+    """Delivers digests at each user's digest_time, pre-rendered (staggered) DIGEST_PREFETCH_MINUTES ahead.
+
+    Users sharing a slot and digest channel share one batched Jira search and are delivered together,
+    packed into as few messages as possible.
+    """
+
+    def __init__(self, user_ids):
+        self.user_ids = user_ids
+        self.events = []
+        self.seq = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.prefetch_pool = ThreadPoolExecutor(max_workers=DIGEST_PREFETCH_WORKERS)
+        self.prepared = {}
+        self.batches = {}  # user_id -> Future of their slot's batched Jira search
+        self.lateness = {}
+
+    def _push(self, when, kind, users, target):
+        with self.lock:
+            heapq.heappush(self.events, (when, self.seq, kind, users, target))
+            self.seq += 1
+        self.wakeup.set()
+
+    def schedule_day(self, user_ids, after=None):
+        """Queue the next prefetch and delivery for each user, staggering users that share a slot."""
+        now = after or datetime.now()
+        slots = {}
+        for user_id in user_ids:
+            hour, minute = user_digest_time(user_id)
+            target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if target <= now:
+                target += timedelta(days=1)
+            slots.setdefault((target, digest_channel(user_id)), []).append(user_id)
+
+        lead = timedelta(minutes=DIGEST_PREFETCH_MINUTES)
+        for (target, channel), users in slots.items():
+            # Pushed first, so at equal times the slot's search starts before its first prefetch
+            self._push(max(target - lead, now).timestamp(), "search", tuple(users), target)
+            for i, user_id in enumerate(users):
+                prefetch_at = target - lead + lead * i / len(users)
+                self._push(max(prefetch_at, now).timestamp(), "prefetch", (user_id,), target)
+            self._push(target.timestamp(), "deliver", tuple(users), target)
+
+    def search(self, user_ids):
+        batch = self.prefetch_pool.submit(slot_jira_issues, user_ids)
+        for user_id in user_ids:
+            self.batches[user_id] = batch
+
+    def build(self, user_id):
+        """Build a user's digest from their slice of the slot's search; without one they search on their own."""
+        batch = self.batches.pop(user_id, None)
+        jira_issues = batch.result().get(user_jira_email(user_id)) if batch is not None else None
+        return build_user_digest(user_id, jira_issues)
+
+    def prefetch(self, user_id):
+        self.prepared[user_id] = self.prefetch_pool.submit(self.build, user_id)
+
+    def prepared_digest(self, user_id):
+        """The prefetched (text, snapshot), or a fresh build if there was no prefetch or it failed or came out partial."""
+        future = self.prepared.pop(user_id, None)
+        if future is not None:
+            try:
+                digest = future.result()
+                if digest[1] is not None:
+                    return digest
+                print(f"⚠️ Prefetched digest for {user_id} is partial, rebuilding")
+            except Exception as e:
+                print(f"⚠️ Prefetched digest for {user_id} failed, rebuilding: {e}")
+        return self.build(user_id)
+
+    def deliver(self, user_ids, target):
+        channel = digest_channel(user_ids[0])
+        try:
+            with command_invocation("scheduled_digest", users=len(user_ids), target=target.isoformat()):
+                unprepared = [user_id for user_id in user_ids if user_id not in self.prepared]
+                if len(unprepared) > 1:
+                    self.search(unprepared)
+                def build(user_id):
+                    try:
+                        return self.prepared_digest(user_id)
+                    except Exception as e:
+                        print(f"❌ Failed to build digest for {user_id}: {e}")
+                        return None
+
+                digests = [(user_id, *digest) for user_id, digest in zip(user_ids, fan_out(build, user_ids)) if digest]
+                sent = post_scheduled_digests(channel, digests) if digests else []
+            late = (datetime.now() - target).total_seconds()
+            for user_id in sent:
+                self.lateness[user_id] = late
+                metrics.observe("digest_delivery_lateness_seconds", late)
+            print(f"📬 Sent {len(sent)}/{len(user_ids)} digests to {channel} for {target.strftime('%H:%M')} ({late:.1f}s late)")
         except Exception as e:
-            print(f"❌ Failed to send digest to {user_id}: {e}")
+            print(f"❌ Failed to send digests to {channel}: {e}")
+        finally:
+            self.schedule_day(user_ids, after=target)
+
+    def run(self):
+        self.schedule_day(self.user_ids)
+        while True:
+            self.wakeup.clear()
+            with self.lock:
+                when = self.events[0][0] if self.events else None
+            delay = when - time.time() if when is not None else None
+            if delay is None or delay > 0:
+                self.wakeup.wait(timeout=delay)
+                continue
+
+            with self.lock:
+                _, _, kind, users, target = heapq.heappop(self.events)
+            if kind == "search":
+                self.search(users)
+            elif kind == "prefetch":
+                self.prefetch(users[0])
+            else:
+                threading.Thread(target=self.deliver, args=(users, target), daemon=True).start()
+
+digest_scheduler = DigestScheduler(list(TEAM_OF))
 
 def run_scheduler():
-    schedule.every().day.at("09:00").do(send_scheduled_digests)
-    while True:
-        schedule.run_pending()
-        time.sleep(60)
+    digest_scheduler.run()
+
+@metrics.collector
+def cache_gauges():
+    for source, counts in upstream_cache.stats().items():
+        for field, value in counts.items():
+            yield f"upstream_cache_{field}", {"source": source}, value
+    with _llm_cache_lock:
+        counts = {field: llm_cache_stats[field] for field in ("hits", "misses", "evictions")}
+    for field, value in counts.items():
+        yield f"llm_cache_{field}", {}, value
+    yield "llm_cache_hit_rate", {}, llm_cache_hit_rate()
+
+@metrics.collector
+def startup_gauges():
+    for phase, seconds in list(startup_phases.items()):
+        yield "startup_phase_seconds", {"phase": phase}, seconds
+
+@metrics.collector
+def job_queue_gauges():
+    stats = job_queue.stats()
+    yield "job_queue_depth", {}, stats["depth"]
+    yield "job_queue_in_flight", {}, stats["in_flight"]
+    for outcome, count in stats["counts"].items():
+        yield "job_queue_jobs", {"outcome": outcome}, count
+
+@metrics.collector
+def scheduler_gauges():
+    lateness = list(digest_scheduler.lateness.values())
+    if lateness:
+        yield "digest_delivery_lateness_max_seconds", {}, max(lateness)
 
 @app.command("/teamday")
-def team_digest(ack, body, say):
+def team_digest(ack, body, say, client):
     ack()
-    requester_id = body['user_id']
-    channel_id = body['channel_id']
-
-    if requester_id not in ALLOWED_USERS:
+    if body['user_id'] not in TEAM_OF:
         say("🚫 You are not authorized to use this command.")
         return
+    dispatch_team_command("/teamday", body, client)
 
-    summary = generate_team_digest()
-
-    # Slack block text must be <= 3000 characters
-    MAX_BLOCK_TEXT = 2900
-    blocks = [
-        {"type": "section", "text": {"type": "mrkdwn", "text": "*🧑‍💻 Team Daily Digest*"}},
-        {"type": "divider"}
-    ]
-
-    # Split large text into chunks of ≤ MAX_BLOCK_TEXT
-    while summary:
-        chunk = summary[:MAX_BLOCK_TEXT]
-        cutoff = chunk.rfind("\n\n")
-        if cutoff == -1 or len(summary) <= MAX_BLOCK_TEXT:
-            cutoff = len(chunk)
-        chunk = summary[:cutoff]
-        summary = summary[cutoff:].lstrip()
+def post_team_digest(body, client, team):
+    channel_id = body['channel_id']
 
-        blocks.append({
-            "type": "section",
-            "text": {"type": "mrkdwn", "text": chunk}
-        })
+    def job(update):
+        summary = generate_team_digest(team)
+        header = [section_block("*🧑‍💻 Team Daily Digest*"), {"type": "divider"}]
+        first, *rest = render_messages(summary, header, [updated_at_block()])
+        # The working message carries the first part; any overflow follows in the same channel
+        update("Team Daily Digest", first)
+        slack_delivery.deliver(channel_id, "Team Daily Digest", rest)
 
-    blocks.append({
-        "type": "context",
-        "elements": [{"type": "mrkdwn", "text": f"_Updated at: {datetime.now().strftime('%I:%M %p')}_"}]
-    })
+    submit_command_job(client, body, ("/teamday", team.name, channel_id), "/teamday", "⏳ Building the team digest…", job)
 
-    say(channel=channel_id, text="Team Daily Digest", blocks=blocks)
 
 
+def generate_team_digest(team):
+    team_issues = get_team_jira_issues(SLACK_TO_JIRA_EMAIL.get(u) for u in team.user_ids)
 
-def generate_team_digest():
-    digest = ""
-    for user_id in ALLOWED_USERS:
+    def build_section(user_id):
         try:
             jira_email = SLACK_TO_JIRA_EMAIL.get(user_id)
             bitbucket_username = SLACK_TO_BITBUCKET_USERNAME.get(user_id)
             if not jira_email or not bitbucket_username:
-                continue
+                return ""
 
-            jira_issues = get_jira_issues(jira_email)
-            user_prs = get_user_created_prs(bitbucket_username)
-            review_prs = get_user_review_prs(bitbucket_username)
+            work = fetch_user_work(jira_email, bitbucket_username, team_issues[jira_email])
+            jira_issues, user_prs, review_prs = (items or [] for items in work)
 
             # Personal header
             header = f"\n*👤 <@{user_id}>*\n"
 
-            section = generate_digest(jira_issues, user_prs, review_prs)
-            short_section = section.split("*🔥 Top 3 Priorities:*")[-1].strip()  # remove LLM summary
-            digest += f"{header}\n{short_section}\n{'-'*40}\n"
+            # The team view shows only the lists, so skip the Top 3 ranking entirely
+            section = generate_digest(jira_issues, user_prs, review_prs, user_id, use_llm=False)
+            return f"{header}\n{section}\n{'-'*40}\n"
         except Exception as e:
-            digest += f"\n<@{user_id}>: ❌ Error fetching data.\n"
+            return f"\n<@{user_id}>: ❌ Error fetching data.\n"
+
+    digest = "".join(fan_out(build_section, team.user_ids))
 
     if not digest:
         return "_No active issues or PRs for the team today._"
 
     return digest
 
+REPORT_CSV_HEADER = [
+    "Scope", "Name", "Open Jira Issues", "Avg PR Review Time (days)", ">3d Unreviewed PRs",
+    "Review Time p50 (days)", "Review Time p90 (days)", "Review Time Max (days)",
+    "PR Age p50 (days)", "PR Age p90 (days)", "PR Age Max (days)",
+]
+
+class ReportStore:
+    """Bounded, expiring store of recent metrics reports, so an export reuses the report its message shows."""
+
+    def __init__(self, max_entries=REPORT_STORE_MAX, ttl=REPORT_STORE_TTL_HOURS * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.reports = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, text, rows):
+        report = {"id": uuid.uuid4().hex[:12], "created_at": time.time(), "text": text, "rows": rows}
+        with self.lock:
+            self.reports[report["id"]] = report
+            while len(self.reports) > self.max_entries:
+                self.reports.popitem(last=False)
+        return report
+
+    def get(self, report_id):
+        with self.lock:
+            report = self.reports.get(report_id)
+            if report and time.time() - report["created_at"] > self.ttl:
+                del self.reports[report_id]
+                report = None
+        return report
+
+report_store = ReportStore()
+
+def new_metrics_report(team):
+    return report_store.add(*generate_metrics_report(team))
+
+def upload_report_csv(report, channel_id):
+    """Serialize the report's rows in memory and upload them; nothing is written to disk."""
+    buffer = io.StringIO(newline="")
+    writer = csv.writer(buffer)
+    writer.writerow(REPORT_CSV_HEADER)
+    writer.writerows(report["rows"])
+    generated = datetime.fromtimestamp(report["created_at"]).strftime("%Y%m%d_%H%M")
+    slack_client.files_upload_v2(
+        content=buffer.getvalue(),
+        filename=f"team_metrics_{generated}.csv",
+        title="Team Metrics CSV",
+        initial_comment="📎 Here's the CSV report:",
+        channels=[channel_id],
+        expiration_ts=int(time.time()) + 86400  # auto-expire in 24 hours
+    )
+
 @app.command("/team-metrics")
-def send_metrics_report(ack, body, say):
+def send_metrics_report(ack, body, say, client):
     ack()
-    user_id = body['user_id']
-    channel_id = body['channel_id']
-
-    if user_id not in ALLOWED_USERS:
+    if body['user_id'] not in TEAM_OF:
         say("🚫 You are not authorized to run this command.")
         return
+    dispatch_team_command("/team-metrics", body, client)
 
-    metrics_text, csv_data = generate_metrics_report()
+def post_metrics_report(body, client, team):
+    channel_id = body['channel_id']
 
-    with tempfile.NamedTemporaryFile(mode='w', newline='', suffix='.csv', delete=False) as tmpfile:
-        writer = csv.writer(tmpfile)
-        writer.writerow(["Email", "Open Jira Issues", "Avg PR Review Time (days)", ">3d Unreviewed PRs"])
-        writer.writerows(csv_data)
-        tmpfile_path = tmpfile.name
+    def job(update):
+        report = new_metrics_report(team)
+        upload_report_csv(report, channel_id)
 
-    try:
-        with open(tmpfile_path, "rb") as f:
-            from time import time
-            slack_client.files_upload_v2(
-                file=f,
-                filename=os.path.basename(tmpfile_path),
-                title="Team Metrics CSV",
-                initial_comment="📎 Here's the CSV report:",
-                channels=[channel_id],
-                expiration_ts=int(time()) + 86400  # auto-expire in 24 hours
-            )
-    finally:
-        os.remove(tmpfile_path)
+        # The button carries the report ID and team, so a later export re-sends this exact report
+        export = {"type": "actions", "elements": [{
+            "type": "button", "action_id": "export_metrics_csv", "value": f"{report['id']}:{team.name}",
+            "text": {"type": "plain_text", "text": "📎 Export CSV again"},
+        }]}
+        first, *rest = render_messages(f"*📊 Team Metrics Report*\n\n{report['text']}", footer=[export])
+        update("Team Metrics Report", first)
+        slack_delivery.deliver(channel_id, "Team Metrics Report", rest)
 
-    say(
-        channel=channel_id,
-        text="*📊 Team Metrics Report*",
-        blocks=[]  # No extra button or duplicate message
-    )
+    submit_command_job(client, body, ("/team-metrics", team.name, channel_id), "/team-metrics", "⏳ Crunching team metrics…", job)
 
 @app.action("export_metrics_csv")
 def handle_export_button(ack, body, client):
     ack()
     channel_id = body['channel']['id']
     user_id = body['user']['id']
-    if user_id not in ALLOWED_USERS:
+    if user_id not in TEAM_OF:
         client.chat_postEphemeral(channel=channel_id, user=user_id, text="🚫 You are not authorized.")
         return
+    # The report lives on the worker of the team it was built for, which may not be the clicker's
+    report_id, _, team_name = ((body.get('actions') or [{}])[0].get('value') or "").partition(":")
+    dispatch_team_command("export_metrics_csv", {"channel_id": channel_id, "user_id": user_id, "report_id": report_id},
+                          client, TEAMS.get(team_name))
 
-    _, csv_data = generate_metrics_report()
-    with tempfile.NamedTemporaryFile(mode='w', newline='', suffix='.csv', delete=False) as tmpfile:
-        writer = csv.writer(tmpfile)
-        writer.writerow(["Email", "Open Jira Issues", "Avg PR Review Time (days)", ">3d Unreviewed PRs"])
-        writer.writerows(csv_data)
-        tmpfile_path = tmpfile.name
-
-    try:
-        from time import time
-        with open(tmpfile_path, "rb") as f:
-            slack_client.files_upload_v2(
-                file=f,
-                filename=os.path.basename(tmpfile_path),
-                title="Team Metrics CSV",
-                initial_comment="📎 Here's the CSV report:",
-                channels=[channel_id],
-                expiration_ts=int(time()) + 86400
-            )
-    finally:
-        os.remove(tmpfile_path)
-
-
-def generate_metrics_report():
-    csv_rows = []
-    lines = []
-
-    for user_id in ALLOWED_USERS:
-        jira_email = SLACK_TO_JIRA_EMAIL.get(user_id)
-        bitbucket_username = SLACK_TO_BITBUCKET_USERNAME.get(user_id)
-        if not jira_email or not bitbucket_username:
-            continue
-
-        jira_issues = get_jira_issues(jira_email)
-        open_issues_count = len(jira_issues)
-        user_prs = get_user_review_prs(bitbucket_username)
-
-        review_times = []
-        old_unreviewed_count = 0
-
-        for pr in user_prs:
-            pr_id = pr['id']
-            pr_url = pr['links']['self']['href']
-            match = re.search(r"/repositories/[^/]+/([^/]+)/", pr_url)
-            repo_slug = match.group(1) if match else None
-            if not repo_slug:
-                continue
+def export_metrics_csv(body, client, team):
+    channel_id = body['channel_id']
 
-            url = f"https://api.bitbucket.org/2.0/repositories/{BITBUCKET_WORKSPACE}/{repo_slug}/pullrequests/{pr_id}/activity"
-            response = requests.get(url, auth=(bitbucket_username, BITBUCKET_APP_PASSWORD))
-            if response.status_code != 200:
-                continue
+    def job(update):
+        report = report_store.get(body['report_id'])
+        if report is None:
+            # Expired or from before a restart: rebuild it
+            report = new_metrics_report(team)
+        upload_report_csv(report, channel_id)
+        update("📎 CSV export ready.")
+
+    submit_command_job(client, body, ("export_metrics_csv", team.name, channel_id),
+                       "export_metrics_csv", "⏳ Preparing the CSV export…", job)
+
+
+def group_stats(values, groups, group_count):
+    """(count, mean, p50, p90, max) of the non-NaN values in each group 0..group_count-1, rounded to 0.1 days.
+
+    Values are sorted by group once and sliced, so the cost grows with the number of values, not values × groups.
+    """
+    import numpy as np
+    keep = ~np.isnan(values)
+    values, groups = values[keep], groups[keep]
+    order = np.argsort(groups, kind="stable")
+    values = values[order]
+    bounds = np.searchsorted(groups[order], np.arange(group_count + 1))
+    stats = []
+    for g in range(group_count):
+        v = values[bounds[g]:bounds[g + 1]]
+        if v.size:
+            stats.append((int(v.size), *(round(float(x), 1) for x in (v.mean(), *np.percentile(v, (50, 90, 100))))))
+        else:
+            stats.append((0, None, None, None, None))
+    return stats
+
+def review_analytics(rows, review_days, member_count):
+    """Review time and open PR age stats per member, per repo and team-wide, on columnar arrays.
+
+    `rows` holds one (member index, repo slug, PR) per PR a member reviews, and `review_days` its review time
+    (None while unreviewed). For repos and the team, a PR with several reviewers counts its age once.
+    Returns {"members": [...], "repos": {slug: ...}, "team": ...} of (review stats, age stats, PRs >3 days).
+    """
+    import numpy as np
+    repos = sorted({repo for _, repo, _ in rows})
+    repo_index = {repo: i for i, repo in enumerate(repos)}
+    member = np.array([i for i, _, _ in rows], dtype=np.intp)
+    repo = np.array([repo_index[r] for _, r, _ in rows], dtype=np.intp)
+    review = np.array([np.nan if d is None else d for d in review_days], dtype=float)
+    now = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None), "s")
+    age = (now - bitbucket_ts_array([pr['created_on'] for _, _, pr in rows])) / np.timedelta64(1, "D")
+    stale = np.floor(age) > 3
+
+    first_row = {}
+    for k, (_, r, pr) in enumerate(rows):
+        first_row.setdefault((r, pr['id']), k)
+    unique = np.fromiter(first_row.values(), dtype=np.intp, count=len(first_row))
+    whole_team = np.zeros(len(rows), dtype=np.intp)
+
+    return {
+        "members": list(zip(group_stats(review, member, member_count), group_stats(age, member, member_count),
+                            np.bincount(member[stale], minlength=member_count).tolist())),
+        "repos": dict(zip(repos, zip(group_stats(review, repo, len(repos)), group_stats(age[unique], repo[unique], len(repos)),
+                                     np.bincount(repo[unique][stale[unique]], minlength=len(repos)).tolist()))),
+        "team": (group_stats(review, whole_team, 1)[0], group_stats(age[unique], whole_team[unique], 1)[0], int(stale[unique].sum())),
+    }
 
-            activities = response.json().get("values", [])
-            reviewer_added_at = None
-            reviewer_reviewed_at = None
+def format_spread(stats):
+    _, _, p50, p90, high = stats
+    return "–" if p50 is None else f"p50 {p50} · p90 {p90} · max {high}"
+
+def generate_metrics_report(team):
+    team_issues = get_team_jira_issues(SLACK_TO_JIRA_EMAIL.get(u) for u in team.user_ids)
+    members = [(u, SLACK_TO_JIRA_EMAIL.get(u), SLACK_TO_BITBUCKET_USERNAME.get(u)) for u in team.user_ids]
+    members = [m for m in members if m[1] and m[2]]
+
+    # One row per (member, PR they review) whose activity could be synced; stats are then computed in batch
+    review_prs = fan_out(lambda m: get_user_review_prs(m[2]) or [], members)
+    rows = [(i, pr['destination']['repository']['slug'], pr) for i, prs in enumerate(review_prs) for pr in prs]
+    synced = fan_out(lambda row: ensure_pr_activity(row[1], row[2], members[row[0]][2]), rows)
+    rows = [row for row, ok in zip(rows, synced) if ok]
+    review_days = stored_review_times([(repo, pr['id'], members[i][2]) for i, repo, pr in rows])
+    analytics = review_analytics(rows, review_days, len(members))
+
+    lines, csv_rows = [], []
+    for (user_id, jira_email, bitbucket_username), (review, age, stale) in zip(members, analytics["members"]):
+        open_issues_count = len(team_issues[jira_email])
+        avg_review_time = review[1] or 0.0
+        trend = " → ".join("–" if t is None else str(t) for t in review_time_trend(bitbucket_username))
+        lines.append(f"• 👤 <@{user_id}> ({jira_email}):\n   - 📝 {open_issues_count} open Jira issues\n"
+                     f"   - ⏱ Avg PR review time: {avg_review_time} days ({format_spread(review)})\n"
+                     f"   - 📈 Weekly review time (last {REVIEW_TREND_WEEKS} weeks): {trend} days\n"
+                     f"   - ⏳ Open review PR age: {format_spread(age)} days\n"
+                     f"   - 🚨 {stale} PRs >3 days unreviewed\n")
+        csv_rows.append(["user", jira_email, open_issues_count, avg_review_time, stale, *review[2:], *age[2:]])
+
+    # Slowest tail first, so the bottleneck repo leads
+    repos = sorted(analytics["repos"].items(), key=lambda item: -(item[1][0][3] or 0))
+    if repos:
+        lines.append("*📦 By repo* (slowest p90 review time first):")
+    for repo_slug, (review, age, stale) in repos:
+        lines.append(f"• `{repo_slug}`: ⏱ review {format_spread(review)} days ({review[0]} reviews), "
+                     f"⏳ age {format_spread(age)} days ({age[0]} PRs), 🚨 {stale} >3 days")
+        csv_rows.append(["repo", repo_slug, "", review[1] or 0.0, stale, *review[2:], *age[2:]])
+
+    review, age, stale = analytics["team"]
+    open_issues_count = sum(len(team_issues[email]) for _, email, _ in members)
+    lines.append(f"\n*🧮 Team-wide*: ⏱ review {format_spread(review)} days, ⏳ age {format_spread(age)} days, "
+                 f"🚨 {stale} PRs >3 days, 📝 {open_issues_count} open Jira issues")
+    csv_rows.append(["team", team.name, open_issues_count, review[1] or 0.0, stale, *review[2:], *age[2:]])
 
-            for activity in activities:
-                user = activity.get("user", {}).get("username")
-                ts = activity.get("created_on")
+    return "\n".join(lines), csv_rows
 
-                if not user or not ts:
-                    continue
+PRIORITY_LABELS = ("Critical", "Moderate", "Minor")
+PRIORITY_COLORS = {"Critical": "#FF4D4D", "Moderate": "#FFD700", "Minor": "#1E90FF"}
+
+def issue_content_hash(issue):
+    fields = issue['fields']
+    return hashlib.sha256(json.dumps([OLLAMA_MODEL, fields['summary'], fields['status']['name']]).encode("utf-8")).hexdigest()
+
+def rule_label(issue):
+    """Label issues whose Jira priority (or an overdue due date) already decides it; None otherwise."""
+    fields = issue['fields']
+    priority = ((fields.get('priority') or {}).get('name') or "").lower()
+    if priority in {p.lower() for p in CRITICAL_PRIORITIES} | {"highest", "critical", "blocker"}:
+        return "Critical"
+    if fields.get('duedate') and fields['duedate'] < datetime.now().strftime("%Y-%m-%d"):
+        return "Critical"
+    if priority in {p.lower() for p in MINOR_PRIORITIES}:
+        return "Minor"
+    return None
 
-                if user == bitbucket_username:
-                    if not reviewer_added_at and activity.get("update"):
-                        reviewers = activity["update"].get("reviewers", [])
-                        for r in reviewers:
-                            if r.get("username") == bitbucket_username:
-                                reviewer_added_at = ts
+def llm_label_batch(issues):
+    """Ask the LLM to label one batch of issues; returns {issue key: label} for the lines it answered."""
+    lines = "\n".join(f"{i['key']}|{i['fields']['status']['name']}|{i['fields']['summary'][:120]}" for i in issues)
+    prompt = f"""
+Classify each of the following Jira issues (one per line as KEY|status|summary) as Critical, Moderate or Minor based on summary and status.
+Answer with exactly one line per issue in the form KEY: Label, and nothing else.
 
-                    if not reviewer_reviewed_at:
-                        if activity.get("approval"):
-                            reviewer_reviewed_at = ts
-                        elif activity.get("comment"):
-                            reviewer_reviewed_at = ts
+{lines}
+"""
+    answer = llm_chat(prompt, "priority")
+    keys = {i['key'] for i in issues}
+    labels = {}
+    for key, label in re.findall(r"([A-Z][A-Z0-9_]*-\d+)\W+(Critical|Moderate|Minor)", answer, re.IGNORECASE):
+        if key in keys:
+            labels.setdefault(key, label.title())
+    return labels
+
+def classify_issues(issues):
+    """Return {issue key: label}, asking the LLM only about issues that are new or changed since last time.
+
+    Rule-decided issues skip the LLM. Other labels are cached in the activity DB by issue key and a
+    hash of summary and status; the rest go to the LLM in batches of PRIORITY_BATCH_SIZE. Issues the
+    LLM could not label are left out.
+    """
+    labels, pending = {}, []
+    for issue in issues:
+        label = rule_label(issue)
+        if label:
+            labels[issue['key']] = label
+            metrics.inc("priority_labels_total", source="rule")
+        else:
+            pending.append(issue)
+
+    db = activity_db()
+    with _activity_db_lock:
+        cached = {
+            key: (content_hash, label)
+            for key, content_hash, label in db.execute(
+                f"SELECT issue_key, content_hash, label FROM issue_labels WHERE issue_key IN ({','.join('?' * len(pending))})",
+                [i['key'] for i in pending],
+            )
+        }
+    misses = []
+    for issue in pending:
+        content_hash, label = cached.get(issue['key'], (None, None))
+        if content_hash == issue_content_hash(issue):
+            labels[issue['key']] = label
+            metrics.inc("priority_labels_total", source="cache")
+        else:
+            misses.append(issue)
+
+    if misses:
+        batches = [misses[i:i + PRIORITY_BATCH_SIZE] for i in range(0, len(misses), PRIORITY_BATCH_SIZE)]
+
+        def label_batch(batch):
+            try:
+                return llm_label_batch(batch)
+            except Exception as e:
+                print(f"⚠️ Could not classify {len(batch)} Jira issues: {e}")
+                return {}
+
+        fresh = {}
+        for batch_labels in fan_out(label_batch, batches, max_workers=OLLAMA_MAX_CONCURRENCY):
+            fresh.update(batch_labels)
+        metrics.inc("priority_labels_total", len(fresh), source="llm")
+        labels.update(fresh)
+        with _activity_db_lock, db:
+            db.executemany(
+                "INSERT OR REPLACE INTO issue_labels VALUES (?, ?, ?, ?)",
+                [(i['key'], issue_content_hash(i), fresh[i['key']], time.time()) for i in misses if i['key'] in fresh],
+            )
+    return labels
 
-            if reviewer_added_at and reviewer_reviewed_at:
-                added = datetime.strptime(reviewer_added_at, "%Y-%m-%dT%H:%M:%S.%f%z")
-                reviewed = datetime.strptime(reviewer_reviewed_at, "%Y-%m-%dT%H:%M:%S.%f%z")
-                delta = (reviewed - added).total_seconds() / (60 * 60 * 24)
-                review_times.append(delta)
+def post_team_critical_issues(body, client, team):
+    channel_id = body['channel_id']
 
-            created_at = datetime.strptime(pr['created_on'], "%Y-%m-%dT%H:%M:%S.%f%z")
-            if (datetime.now(datetime.utcnow().astimezone().tzinfo) - created_at).days > 3:
-                old_unreviewed_count += 1
+    def job(update):
+        user_ids = [u for u in team.user_ids if SLACK_TO_JIRA_EMAIL.get(u)]
+        team_issues = get_team_jira_issues([SLACK_TO_JIRA_EMAIL[u] for u in user_ids], priorities=CRITICAL_PRIORITIES)
+        critical_priorities = {p.lower() for p in CRITICAL_PRIORITIES}
+
+        summary_lines = []
+        for user_id in user_ids:
+            for issue in team_issues[SLACK_TO_JIRA_EMAIL[user_id]]:
+                key = issue['key']
+                summary = issue['fields']['summary']
+                status = issue['fields']['status']['name']
+                priority_obj = issue['fields'].get('priority')
+                priority = priority_obj.get('name', '').lower() if priority_obj else ''
+
+                if priority in critical_priorities:
+                    jira_url = f"{JIRA_BASE_URL}/browse/{key}"
+                    summary_lines.append(f"*<{jira_url}|{key}>*: {summary} _(Status: {status}, Priority: {priority.title()}, Owner: <@{user_id}>)_")
+
+        if not summary_lines:
+            update("✅ No critical Jira issues found.")
+            return
+
+        blocks = [
+            {"type": "header", "text": {"type": "plain_text", "text": "🔥 Team-Wide Critical Jira Issues"}},
+            {"type": "divider"}
+        ]
 
-        avg_review_time = round(sum(review_times) / len(review_times), 1) if review_times else 0.0
+        for line in summary_lines:
+            blocks.append({
+                "type": "section",
+                "text": {"type": "mrkdwn", "text": f":red_circle: {line}"}
+            })
 
-        lines.append(f"• 👤 <@{user_id}> ({jira_email}):\n   - 📝 {open_issues_count} open Jira issues\n   - ⏱ Avg PR review time: {avg_review_time} days\n   - 🚨 {old_unreviewed_count} PRs >3 days unreviewed\n")
-        csv_rows.append([jira_email, open_issues_count, avg_review_time, old_unreviewed_count])
+        update("Critical Jira Issues", blocks)
 
-    return "\n".join(lines), csv_rows
+    submit_command_job(client, body, ("/priority", team.name, channel_id), "/priority", "⏳ Collecting critical Jira issues…", job)
 
-@app.command("/priority")
-def classify_priorities(ack, body, say):
-    ack()
+def post_my_issue_labels(body, say, client):
     user_id = body['user_id']
     email = SLACK_TO_JIRA_EMAIL.get(user_id)
     if not email:
         say("🚫 No email mapping found for this user.")
         return
 
-    issues = get_jira_issues(email)
-    if not issues:
-        say("✅ No active Jira issues found.")
-        return
-
-    summary_text = ""
-    for issue in issues:
-        key = issue['key']
-        summary = issue['fields']['summary']
-        status = issue['fields']['status']['name']
-        summary_text += f"- [{key}] {summary} ({status})\n"
-
-    prompt = f"""
-From the following Jira issues, classify each as Critical, Moderate, or Minor based on summary and status:
-
-{summary_text}
-"""
-
-    response = ollama.chat(model="llama3", messages=[{"role": "user", "content": prompt}])
-    categories = response['message']['content']
-
-    blocks = [
-        {"type": "section", "text": {"type": "mrkdwn", "text": "*📌 AI-based Priority Classification*"}},
-        {"type": "divider"},
-    ]
-
-    for line in categories.splitlines():
-        if line.strip():
-            if "Critical" in line:
-                color = "#FF4D4D"
-            elif "Moderate" in line:
-                color = "#FFD700"
-            elif "Minor" in line:
-                color = "#1E90FF"
-            else:
-                color = "#CCCCCC"
+    def job(update):
+        issues = get_jira_issues(email)
+        if issues is None:
+            update("❌ Couldn't reach Jira, try again in a minute.")
+            return
+        if not issues:
+            update("✅ No active Jira issues found.")
+            return
+
+        labels = classify_issues(issues)
+        rank = {label: i for i, label in enumerate(PRIORITY_LABELS)}
+        issues = sorted(issues, key=lambda i: rank.get(labels.get(i['key']), len(rank)))
+
+        blocks = [
+            {"type": "section", "text": {"type": "mrkdwn", "text": "*📌 AI-based Priority Classification*"}},
+            {"type": "divider"},
+        ]
 
+        # Slack allows 50 blocks per message
+        for issue in issues[:47]:
+            label = labels.get(issue['key'], "Unclassified")
+            line = f"[{issue['key']}] {issue['fields']['summary']} ({issue['fields']['status']['name']}) - {label}"
             blocks.append({
                 "type": "context",
                 "elements": [
                     {
                         "type": "mrkdwn",
-                        "text": f"```{line.strip()}```"
+                        "text": f"```{line}```"
                     },
                     {
                         "type": "image",
-                        "image_url": f"https://singlecolorimage.com/get/{color}/16x16",
+                        "image_url": f"https://singlecolorimage.com/get/{PRIORITY_COLORS.get(label, '#CCCCCC').lstrip('#')}/16x16",
                         "alt_text": "priority"
                     }
                 ]
             })
+        if len(issues) > 47:
+            blocks.append({"type": "context", "elements": [{"type": "mrkdwn", "text": f"_…and {len(issues) - 47} more_"}]})
+
+        update("AI-based Priority Classification", blocks)
+
+    submit_command_job(client, body, ("/priority", user_id), "/priority", "⏳ Classifying your Jira issues…", job)
+
+@app.command("/priority")
+def classify_priorities(ack, body, say, client):
+    """`/priority [team|me] [refresh]`: the team's critical issues (default), or your own issues classified."""
+    ack()
+    if {"me", "mine"} & set(body.get("text", "").lower().split()):
+        if wants_refresh(body):
+            upstream_cache.invalidate()
+        post_my_issue_labels(body, say, client)
+    elif body['user_id'] not in TEAM_OF:
+        say("🚫 You are not authorized to use this command.")
+    else:
+        dispatch_team_command("/priority", body, client)
+
+TEAM_COMMANDS = {
+    "/teamday": post_team_digest,
+    "/team-metrics": post_metrics_report,
+    "/priority": post_team_critical_issues,
+    "export_metrics_csv": export_metrics_csv,
+}
+
+def run_team_command(command, team, body, client):
+    if wants_refresh(body):
+        upstream_cache.invalidate()
+    TEAM_COMMANDS[command](body, client, team)
+
+def dispatch_team_command(command, body, client, team=None):
+    """Run a team command for `team` (default: the requester's) on its worker process, or here without workers."""
+    team = team or TEAM_OF[body['user_id']]
+    if not team_workers.dispatch(team, command, body):
+        run_team_command(command, team, body, client)
+
+def push_worker_metrics(shard, outbox):
+    while True:
+        time.sleep(5)
+        outbox.put((shard, metrics.samples()))
+
+def run_team_worker(shard, team_names, rate_share, ollama_slots, channel_buckets, inbox, outbox):
+    """Team worker process: deliver its teams' scheduled digests and run the team commands routed to it."""
+    global BITBUCKET_REPOS, _rate_share, _ollama_slots
+    teams = [TEAMS[name] for name in team_names]
+    BITBUCKET_REPOS = sorted({repo for team in teams for repo in team.repos})
+    _rate_share = rate_share
+    _ollama_slots = ollama_slots
+    slack_delivery.buckets.update(channel_buckets)
+    if WEBHOOK_PORT and WEBHOOK_SECRET:
+        # The main process receives the webhooks and forwards them here
+        threading.Thread(target=work_index.run, name="work-index", daemon=True).start()
+    digest_scheduler.user_ids = [user_id for team in teams for user_id in team.user_ids]
+    threading.Thread(target=run_scheduler, name="digest-scheduler", daemon=True).start()
+    # Nobody scrapes a worker, so its samples go to the main process's /metrics
+    threading.Thread(target=push_worker_metrics, args=(shard, outbox), name="metrics-push", daemon=True).start()
+    print(f"👷 Team worker {os.getpid()} serving {', '.join(team_names)}")
 
-    say(blocks=blocks)
+    while True:
+        kind, name, data = inbox.get()
+        try:
+            if kind == "webhook":
+                work_index.apply_jira_event(data) if name == "jira" else work_index.apply_bitbucket_event(data)
+            else:
+                team_name, body = data
+                run_team_command(name, TEAMS[team_name], body, slack_client)
+        except Exception as e:
+            print(f"❌ Team worker failed to handle {name}: {e}")
+
+class TeamWorkers:
+    """Worker processes running team commands and scheduled digests, each for a shard of teams (largest first)."""
+
+    def __init__(self, teams, workers):
+        teams = sorted(teams, key=lambda team: -len(team.user_ids))
+        self.shards = [[] for _ in range(max(0, min(workers, len(teams))))]
+        self.shard_of = {}
+        load = [0] * len(self.shards)
+        for team in teams if self.shards else ():
+            shard = load.index(min(load))
+            self.shards[shard].append(team.name)
+            self.shard_of[team.name] = shard
+            load[shard] += len(team.user_ids)
+        self.context = multiprocessing.get_context("spawn")
+        self.inboxes, self.processes = [], []
+        self.outbox = None
+        self.ollama_slots = None
+        self.channel_buckets = {}
+        self.samples = {}  # shard -> latest metrics samples pushed by its worker
+        self.restarts = Counter()
+
+    def start(self):
+        """Spawn the workers and keep them running; the main process keeps one share of the rate limits.
+
+        Ollama's slots and the digest channels' Slack buckets are shared with the workers instead, since
+        every process posts to the same server and channels.
+        """
+        global _rate_share, _ollama_slots
+        if not self.shards:
+            return
+        _rate_share = 1 / (len(self.shards) + 1)
+        _ollama_slots = self.ollama_slots = self.context.BoundedSemaphore(OLLAMA_MAX_CONCURRENCY)
+        channels = {team.digest_channel for team in TEAMS.values()} | {DIGEST_CHANNEL_ID}
+        self.channel_buckets = {
+            channel: TokenBucket(SLACK_CHANNEL_RATE_PER_SECOND, SLACK_CHANNEL_BURST, self.context) for channel in channels if channel
+        }
+        slack_delivery.buckets.update(self.channel_buckets)
+        self.outbox = self.context.Queue()
+        threading.Thread(target=self._collect_metrics, name="team-worker-metrics", daemon=True).start()
+        for shard in range(len(self.shards)):
+            self.inboxes.append(self.context.Queue())
+            self.processes.append(None)
+            self._spawn(shard)
+        threading.Thread(target=self._supervise, name="team-workers", daemon=True).start()
+
+    def _spawn(self, shard):
+        args = (shard, self.shards[shard], _rate_share, self.ollama_slots, self.channel_buckets, self.inboxes[shard], self.outbox)
+        process = self.context.Process(target=run_team_worker, args=args, name=f"team-worker-{shard}", daemon=True)
+        process.start()
+        self.processes[shard] = process
+
+    def _collect_metrics(self):
+        while True:
+            shard, samples = self.outbox.get()
+            self.samples[shard] = samples
+
+    def _supervise(self):
+        while True:
+            time.sleep(5)
+            for shard, process in enumerate(self.processes):
+                if not process.is_alive():
+                    # Its inbox outlives it, so queued commands run on the replacement
+                    print(f"⚠️ Team worker for {', '.join(self.shards[shard])} exited with {process.exitcode}, restarting")
+                    self.restarts[shard] += 1
+                    self._spawn(shard)
+
+    def dispatch(self, team, command, body):
+        """Queue a team command on its team's worker; False when team work runs in this process."""
+        if not self.processes:
+            return False
+        self.inboxes[self.shard_of[team.name]].put(("command", command, (team.name, body)))
+        return True
+
+    def forward_webhook(self, source, payload):
+        for inbox in self.inboxes:
+            inbox.put(("webhook", source, payload))
+
+team_workers = TeamWorkers(TEAMS.values(), TEAM_WORKERS)
+
+@metrics.collector
+def team_worker_gauges():
+    for shard, process in enumerate(team_workers.processes):
+        labels = {"shard": str(shard), "teams": ",".join(team_workers.shards[shard])}
+        yield "team_worker_up", labels, int(process.is_alive())
+        yield "team_worker_restarts", labels, team_workers.restarts[shard]
+    for shard, samples in list(team_workers.samples.items()):
+        for name, labels, value in samples:
+            yield name, {**dict(labels), "worker": str(shard)}, value
+
+startup_phase("handlers")
 
 if __name__ == "__main__":
-    threading.Thread(target=run_scheduler, daemon=True).start()
+    # The model loads while we connect to Slack; commands that arrive first just wait on Ollama
+    if OLLAMA_WARMUP:
+        threading.Thread(target=warm_up_llm, name="llm-warmup", daemon=True).start()
+    start_metrics_server()
+    # Workers first, so they hold their rate-limit share before the work index starts fetching
+    team_workers.start()
+    start_webhook_server()
+    if not team_workers.processes:
+        threading.Thread(target=run_scheduler, daemon=True).start()
+    startup_phase("background_services")
+
+    from slack_bolt.adapter.socket_mode import SocketModeHandler
     handler = SocketModeHandler(app, SLACK_APP_TOKEN)
-    handler.start()
+    handler.connect()
+    startup_phase("socket_mode")
+    print(f"🚀 Serving commands after {time.perf_counter() - _startup_started:.2f}s ("
+          + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in list(startup_phases.items())
+                      if name not in ("ollama_ready", "model_load")) + ")")
+    threading.Event().wait()
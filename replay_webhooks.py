@@ -0,0 +1,63 @@
+"""Replay recorded Jira/Bitbucket webhook payloads against a running webhook receiver.
+
+Payloads are the JSON lines main.py appends to WEBHOOK_RECORD_PATH, one per received webhook:
+{"path": "/webhooks/jira", "event_key": null, "body": "<raw JSON body>"}. Each body is re-signed
+with WEBHOOK_SECRET (or --secret) and posted in order, so a work index can be rebuilt or a bug
+reproduced locally.
+
+    WEBHOOK_SECRET=s3cret python replay_webhooks.py webhooks.jsonl
+    python replay_webhooks.py webhooks.jsonl --url http://127.0.0.1:9109 --secret s3cret --delay 0.1
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def replay(path, url, secret, delay=0.0):
+    # Read everything up front: the receiver may be appending to this same file while we replay
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    sent = failed = 0
+    for record in records:
+        body = record["body"].encode("utf-8")
+        headers = {
+            "Content-Type": "application/json",
+            "X-Hub-Signature": "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest(),
+        }
+        if record.get("event_key"):
+            headers["X-Event-Key"] = record["event_key"]
+        request = urllib.request.Request(url.rstrip("/") + record["path"], data=body, headers=headers, method="POST")
+        try:
+            urllib.request.urlopen(request).close()
+            sent += 1
+        except urllib.error.HTTPError as e:
+            failed += 1
+            print(f"❌ {record['path']}: HTTP {e.code}", file=sys.stderr)
+        if delay:
+            time.sleep(delay)
+    return sent, failed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="JSON lines file recorded via WEBHOOK_RECORD_PATH")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{os.getenv('WEBHOOK_PORT') or 9109}")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET"))
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait between payloads")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not args.secret:
+        sys.exit("Set WEBHOOK_SECRET or pass --secret")
+    sent, failed = replay(args.path, args.url, args.secret, args.delay)
+    print(f"Replayed {sent} payloads ({failed} failed)")
+    sys.exit(1 if failed else 0)